@@ -2,12 +2,16 @@
 # Copyright © 2025 PantheonAI. All rights reserved.
 
 import os
+import time
 import openai
-import tiktoken
-import requests
-from bs4 import BeautifulSoup
-from datetime import datetime
-from sqlalchemy import create_engine, text
+from datetime import datetime, timezone
+from sqlalchemy import text
+from llm_stream import StreamedAnswer
+from web_fetch import WebFetcher
+from chunker import encoding_for_model
+from telemetry import TelemetryWriter
+from router import Router, ROUTER_MODEL
+from resources import Lazy, embedding_model, lazy_engine
 
 # Azure OpenAI Config
 AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY")
@@ -21,13 +25,23 @@ openai.api_key = AZURE_OPENAI_KEY
 openai.api_base = AZURE_OPENAI_ENDPOINT
 openai.api_version = AZURE_OPENAI_API_VERSION
 
+# Print the report as it is generated instead of after the full completion
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+
 # PostgreSQL connection string (ensure this env var is set)
 PG_CONN_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
-engine = create_engine(PG_CONN_STRING, pool_size=20, max_overflow=0)
+engine = lazy_engine(PG_CONN_STRING, pool_size=20, max_overflow=0)
+
+# Pooled, per-host-limited, disk-cached page fetches (see web_fetch.py)
+web_fetcher = WebFetcher()
+
+# Local request classifier; extract_subject is only called when it isn't sure.
+# Model and route centroids are built on the first request (see resources.py)
+router = Lazy("request router", lambda: Router(embedding_model(ROUTER_MODEL)))
 
 # Initialize PostgreSQL logging table for queries
 def init_db():
-    with engine.connect() as conn:
+    with engine.begin() as conn:
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS query_log (
                 id SERIAL PRIMARY KEY,
@@ -38,22 +52,17 @@ def init_db():
             )
         """))
 
-# Log query details in PostgreSQL
+# Query rows are batched into query_log by a background thread
+query_log_writer = TelemetryWriter(engine, "query_log", ["timestamp", "user_goal", "analysis_type", "token_count"])
+
+# Log query details in PostgreSQL (queued; no database round trip here)
 def log_query(user_goal, analysis_type, token_count):
-    with engine.connect() as conn:
-        conn.execute(text("""
-            INSERT INTO query_log (user_goal, analysis_type, token_count)
-            VALUES (:user_goal, :analysis_type, :token_count)
-        """), {
-            'user_goal': user_goal,
-            'analysis_type': analysis_type,
-            'token_count': token_count
-        })
+    query_log_writer.record((datetime.now(timezone.utc), user_goal, analysis_type, token_count))
 
 # Estimate tokens for cost/control
 def estimate_tokens(text, model="gpt-4o"):
-    enc = tiktoken.encoding_for_model(model)
-    return len(enc.encode(text))
+    # Encoder is built once per model and reused
+    return len(encoding_for_model(model).encode_ordinary(text))
 
 # Extract a short subject summary for routing and prompt tuning
 def extract_subject(question, model=AZURE_DEPLOYMENT_NAME_GPT35):
@@ -72,12 +81,24 @@ def extract_subject(question, model=AZURE_DEPLOYMENT_NAME_GPT35):
 # Get website text content for context (can be replaced with a real technical knowledge base or docs)
 def get_website_text(url):
     try:
-        response = requests.get(url, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        return soup.get_text()
+        return web_fetcher.fetch_text(url)
     except Exception as e:
         return f"[ERROR] Failed to load content from {url}: {e}"
 
+# Decide analysis type, whether to search the web, and whether to use gpt-4o
+def route_request(user_goal):
+    label, similarity = router.classify(user_goal)
+    if label is not None:
+        search, complex_request = router.flags(label)
+        print(f"[INFO] Routed locally: {label} ({similarity:.2f})")
+        return label, search, complex_request
+
+    # Low confidence: fall back to the LLM label and keyword rules
+    analysis_type = extract_subject(user_goal)
+    keywords_trigger_search = ['analysis', 'report', 'simulation', 'model', 'design', 'failure', 'risk', 'assessment']
+    search = any(word in analysis_type.lower() for word in keywords_trigger_search)
+    return analysis_type, search, "complex" in analysis_type.lower()
+
 # Stub web search example for engineering topics; replace with your own sources or APIs
 def web_search(query, max_results=3):
     print(f"[INFO] Running technical web search for query: {query}")
@@ -88,24 +109,22 @@ def web_search(query, max_results=3):
     ][:max_results]
 
 # Main orchestration: generate an engineering or analyst expert response
-def auto_tool_orchestrator(user_goal):
+# With stream=True, on_token(piece) is called as each piece of the report arrives
+def auto_tool_orchestrator(user_goal, stream=False, on_token=None):
     print(f"\n[INFO] Starting engineering analysis generation for goal: {user_goal}")
 
-    analysis_type = extract_subject(user_goal)
+    analysis_type, needs_search, complex_request = route_request(user_goal)
     print(f"[INFO] Extracted analysis type: {analysis_type}")
 
-    keywords_trigger_search = ['analysis', 'report', 'simulation', 'model', 'design', 'failure', 'risk', 'assessment']
-    if any(word in analysis_type.lower() for word in keywords_trigger_search):
+    if needs_search:
         urls = web_search(user_goal)
-        aggregated_text = ""
-        for url in urls:
-            text = get_website_text(url)
-            if "[ERROR]" not in text:
-                aggregated_text += text[:2000] + "\n\n"
+        # All pages at once under one deadline; failed or slow ones are skipped
+        pages = web_fetcher.fetch_texts(urls, max_chars=2000)
+        aggregated_text = "".join(text + "\n\n" for text in pages.values())
     else:
         aggregated_text = ""
 
-    model = AZURE_DEPLOYMENT_NAME_GPT4O if "complex" in analysis_type.lower() else AZURE_DEPLOYMENT_NAME_GPT35
+    model = AZURE_DEPLOYMENT_NAME_GPT4O if complex_request else AZURE_DEPLOYMENT_NAME_GPT35
 
     # Prompt tailored for engineering and analyst expert
     role_prompt = (
@@ -126,14 +145,27 @@ def auto_tool_orchestrator(user_goal):
         {"role": "user", "content": user_goal}
     ]
 
+    start = time.perf_counter()
     response = openai.ChatCompletion.create(
         engine=model,
         messages=messages,
         temperature=0.3,
-        max_tokens=700
+        max_tokens=700,
+        stream=stream
     )
 
-    output_text = response.choices[0].message["content"]
+    if stream:
+        streamed = StreamedAnswer(response, start)
+        for piece in streamed:
+            if on_token is not None:
+                on_token(piece)
+        output_text = streamed.text
+        first_token_seconds = streamed.ttft
+    else:
+        output_text = response.choices[0].message["content"]
+        first_token_seconds = None
+    total_seconds = time.perf_counter() - start
+    # Counted on the full text once the stream has ended, same as the non-streamed path
     token_count = estimate_tokens(output_text, model=model)
 
     # Log query with analysis type and token usage
@@ -142,7 +174,9 @@ def auto_tool_orchestrator(user_goal):
     return {
         "document": output_text,
         "analysis_type": analysis_type,
-        "tokens_used": token_count
+        "tokens_used": token_count,
+        "first_token_seconds": first_token_seconds,
+        "total_seconds": total_seconds
     }
 
 if __name__ == "__main__":
@@ -155,10 +189,22 @@ if __name__ == "__main__":
         if user_goal.lower() == "quit":
             break
 
-        result = auto_tool_orchestrator(user_goal)
-
-        print("\n📄 Generated Report:\n")
-        print(result["document"])
+        if STREAM_ANSWERS:
+            started = []
+
+            def show(piece):
+                if not started:
+                    started.append(True)
+                    print("\n📄 Generated Report:\n")
+                print(piece, end="", flush=True)
+
+            result = auto_tool_orchestrator(user_goal, stream=True, on_token=show)
+            print(f"\n\n⏱️ First token after {result['first_token_seconds'] or 0:.2f}s, "
+                  f"done in {result['total_seconds']:.2f}s")
+        else:
+            result = auto_tool_orchestrator(user_goal)
+            print("\n📄 Generated Report:\n")
+            print(result["document"])
         print(f"\n🗂️ Analysis Type: {result['analysis_type']}")
         print(f"🔢 Tokens Used: {result['tokens_used']}")
         print("\n" + "-"*80 + "\n")
\ No newline at end of file
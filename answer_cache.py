@@ -0,0 +1,177 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from query_cache import normalize_query
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_PATH = os.getenv(
+    "ANSWER_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "ragtoriches", "answer_cache.sqlite"),
+)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+# Cosine similarity above which a differently worded question over the same
+# chunks reuses the answer; 0 turns semantic matching off (exact text only)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+def chunk_hash(chunk_text):
+    # Same hash ingest stores in documents.chunk_hash
+    return hashlib.sha256(chunk_text.encode("utf-8")).hexdigest()
+
+
+def context_key(model, template, chunk_hashes, embedder=""):
+    # Order-insensitive: the same retrieved set answers the same way. The
+    # embedder is part of the key because stored question embeddings are only
+    # comparable within one embedding model (scripts share ANSWER_CACHE_PATH)
+    parts = [model, embedder, hashlib.sha256(template.encode("utf-8")).hexdigest()] + sorted(set(chunk_hashes))
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+# ────────────────────────────────────────────────
+# ANSWER CACHE
+# ────────────────────────────────────────────────
+class AnswerCache:
+    """Persistent cache of LLM answers in front of the chat completion call.
+
+    Entries are keyed by (model, prompt template, retrieved chunk hashes). A
+    lookup matches the normalized question exactly or, when a query embedding
+    is given, any cached question over the same key whose embedding is at
+    least `similarity` cosine-close. Answers rejected through feedback are
+    never served again. Least recently used entries are evicted past
+    `max_entries`.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 similarity=ANSWER_CACHE_SIMILARITY, enabled=ANSWER_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        if not enabled:
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                context_key TEXT NOT NULL,
+                query TEXT NOT NULL,
+                embedding BLOB,
+                answer TEXT NOT NULL,
+                prompt_tokens INTEGER,
+                model TEXT,
+                latency_seconds REAL NOT NULL,
+                last_used REAL NOT NULL,
+                rejected INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (context_key, query)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS answers_answer ON answers (answer)")
+        self.db.commit()
+
+    def get(self, key, query, embedding=None):
+        # Returns (answer, prompt_tokens, model) or None
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        query = normalize_query(query)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT answer, prompt_tokens, model, latency_seconds FROM answers "
+                "WHERE context_key = ? AND query = ? AND rejected = 0",
+                (key, query),
+            ).fetchone()
+            matched = query
+            if row is None and embedding is not None and self.similarity > 0:
+                row, matched = self._closest(key, embedding)
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute(
+                "UPDATE answers SET last_used = ? WHERE context_key = ? AND query = ?",
+                (time.time(), key, matched),
+            )
+            self.db.commit()
+            self.hits += 1
+            self.saved_seconds += max(0.0, row[3] - (time.perf_counter() - start))
+        logging.info(f"💾 Answer cache hit ({'exact' if matched == query else 'semantic'})")
+        return row[0], row[1], row[2]
+
+    def _closest(self, key, embedding):
+        # Candidates share the retrieved chunk set, so this scan stays tiny
+        candidates = self.db.execute(
+            "SELECT answer, prompt_tokens, model, latency_seconds, query, embedding FROM answers "
+            "WHERE context_key = ? AND rejected = 0 AND embedding IS NOT NULL",
+            (key,),
+        ).fetchall()
+        if not candidates:
+            return None, None
+        q = np.asarray(embedding, dtype="float32").ravel()
+        q = q / (np.linalg.norm(q) or 1.0)
+        # Entries written under older keys may come from another embedding model
+        candidates = [c for c in candidates if len(c[5]) == q.nbytes]
+        if not candidates:
+            return None, None
+        vectors = np.stack([np.frombuffer(c[5], dtype="float32") for c in candidates])
+        scores = vectors @ q / np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None, None
+        return candidates[best][:4], candidates[best][4]
+
+    def put(self, key, query, answer, prompt_tokens, model, latency_seconds, embedding=None):
+        if not self.enabled:
+            return
+        blob = None
+        if embedding is not None:
+            blob = np.asarray(embedding, dtype="float32").ravel().tobytes()
+        with self.lock:
+            # Replaces a rejected answer for the same question with the fresh one
+            self.db.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(context_key, query, embedding, answer, prompt_tokens, model, latency_seconds, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_query(query), blob, answer, prompt_tokens, model, latency_seconds, time.time()),
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        count = self.db.execute("SELECT count(*) FROM answers").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute(
+                "DELETE FROM answers WHERE rowid IN "
+                "(SELECT rowid FROM answers ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def reject(self, answer):
+        # Called for "no" feedback; the answer text identifies every entry serving it
+        if not self.enabled:
+            return
+        with self.lock:
+            self.db.execute("UPDATE answers SET rejected = 1 WHERE answer = ?", (answer,))
+            self.db.commit()
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        logging.info(
+            f"📊 Answer cache: {self.hits}/{total} hits ({rate:.0%}), "
+            f"~{self.saved_seconds:.1f}s of LLM latency saved"
+        )
+
+    def close(self):
+        if self.enabled:
+            self.log_stats()
+            self.db.close()
@@ -1,18 +1,32 @@
 import os
+import argparse
+import logging
 import psycopg2
 import numpy as np
 import fitz  # PyMuPDF
 import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
+from bulk_writer import BulkWriter
+from faiss_store import (
+    INDEX_TYPES, VectorSpool, write_index_atomic, make_index, with_ids, add_with_ids,
+    add_in_blocks, remove_ids, set_search_params, train_index, evaluate_index,
+    is_quantized, is_id_mapped, storage_report, prune_spool, FAISS_RESCORE_CANDIDATES,
+)
+from embed_batch import EmbeddingBatcher, embed_texts
+from embedding_cache import open_cache
+from resources import Lazy, lazy_embedder
 
 load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 
 # === External HDD paths ===
 HDD_PATH = "/media/username/ExternalHDD/ai_vector/"
 FAISS_INDEX_PATH = os.path.join(HDD_PATH, "faiss.index")
-ID_MAP_PATH = os.path.join(HDD_PATH, "id_map.pkl")
+# Full-precision vectors + ids, spooled to disk as they are embedded
+VECTOR_SPOOL_PATH = os.path.join(HDD_PATH, "vectors")
+
+# Chunks inserted, embedded and indexed per step; bounds peak memory
+BUILD_BATCH_SIZE = int(os.getenv("BUILD_BATCH_SIZE", "1024"))
 
 # === PostgreSQL config ===
 DB_CONFIG = {
@@ -24,59 +38,201 @@ DB_CONFIG = {
 }
 
 EMBED_DIM = 1024  # e5-large-v2
-model = SentenceTransformer("intfloat/e5-large-v2")
-
-# Connect DB
-conn = psycopg2.connect(**DB_CONFIG)
-cur = conn.cursor()
+MODEL_NAME = "intfloat/e5-large-v2"
+# Model and connection open on first use, so --help and argument errors are instant
+model = lazy_embedder(MODEL_NAME)
+conn = Lazy("PostgreSQL connection", lambda: psycopg2.connect(**DB_CONFIG))
+cur = Lazy("PostgreSQL cursor", lambda: conn.cursor())
 
-def chunk_pdf(pdf_path):
+def iter_chunks(pdf_path):
     doc = fitz.open(pdf_path)
-    chunks = []
     for page_num in range(len(doc)):
         text = doc[page_num].get_text()
         for sent in text.split(". "):
             clean = sent.strip().replace("\n", " ")
             if clean:
-                chunks.append({
+                yield {
                     "content": clean,
                     "page": page_num + 1,
                     "title": os.path.basename(pdf_path),
                     "chapter": "N/A"
-                })
-    return chunks
+                }
+
+def chunk_pdf(pdf_path):
+    return list(iter_chunks(pdf_path))
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 def insert_metadata(chunks):
-    insert_query = """
-    INSERT INTO chunks (content, page, title, chapter)
-    VALUES (%s, %s, %s, %s)
-    RETURNING id
-    """
-    ids = []
-    for c in chunks:
-        cur.execute(insert_query, (
-            c["content"], c["page"], c["title"], c["chapter"]
-        ))
-        ids.append(cur.fetchone()[0])
+    # COPY with ids reserved from the chunks.id sequence, in chunk order,
+    # so they line up with the FAISS vectors
+    writer = BulkWriter(conn, "chunks", ["content", "page", "title", "chapter"], id_column="id")
+    return writer.write(
+        (c["content"], c["page"], c["title"], c["chapter"]) for c in chunks
+    )
+
+def build_faiss(chunks, index_type="flat", nlist=None, m=32, pq_m=None,
+                ef_construction=200, ef_search=64, nprobe=16, eval_k=10, eval_queries=200,
+                rebuild=False, batch_size=BUILD_BATCH_SIZE, rescore_candidates=FAISS_RESCORE_CANDIDATES):
+    # `chunks` may be any iterable (e.g. iter_chunks); it is consumed in
+    # fixed-size batches that are inserted, embedded and spooled one at a time.
+    append = not rebuild and os.path.exists(FAISS_INDEX_PATH)
+    if append:
+        # New vectors go straight into the existing (already trained) index
+        index = faiss.read_index(FAISS_INDEX_PATH)
+        if not is_id_mapped(index):
+            # Checked before any chunk rows are committed to Postgres
+            raise RuntimeError(
+                f"{FAISS_INDEX_PATH} predates id mapping and can't be appended to; "
+                "rebuild it with build_index.py --rebuild"
+            )
+        logging.info(f"➕ Appending to index of {index.ntotal} vectors")
+    elif nlist is None and index_type.startswith("ivf"):
+        # The default nlist depends on corpus size, so IVF is created after spooling
+        index = None
+    else:
+        index = with_ids(make_index(index_type, EMBED_DIM, nlist=nlist, m=m, pq_m=pq_m,
+                                    ef_construction=ef_construction))
+    # Flat/HNSW (and appends) take vectors as they arrive; IVF must train first
+    add_now = index is not None and index.is_trained
+
+    # Cache keys cover the "passage: " prefix, so these never collide with
+    # un-prefixed ingest embeddings from the same model
+    batcher = EmbeddingBatcher(model, prefix="passage: ", cache=open_cache(MODEL_NAME))
+    spool = VectorSpool(VECTOR_SPOOL_PATH, EMBED_DIM, append=append)
+    total = 0
+    try:
+        for batch in batched(chunks, batch_size):
+            ids = insert_metadata(batch)
+            embeddings = np.asarray(embed_texts(batcher, [c["content"] for c in batch]), dtype="float32")
+            spool.write(embeddings, ids)
+            if add_now:
+                add_with_ids(index, embeddings, ids)
+            total += len(batch)
+            logging.info(f"📥 Indexed {total} chunks")
+    finally:
+        spool.close()
+        batcher.close()
+
+    vectors, all_ids = spool.open()
+    if not add_now and len(vectors) == 0:
+        logging.warning("⚠️ No chunks to index; FAISS index left unchanged")
+        return total, None
+    if not add_now:
+        if index is None:
+            index = with_ids(make_index(index_type, EMBED_DIM, m=m, pq_m=pq_m,
+                                        ef_construction=ef_construction, n_vectors=len(vectors)))
+        train_index(index, vectors)
+        add_in_blocks(index, vectors, all_ids)
+    if not append:
+        set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+
+    report = None
+    # Recall is only measured on fresh builds, where the spool holds exactly the index
+    if eval_queries and total and not append:
+        # Quantized indexes are also measured the way query_faiss.py searches them:
+        # a wider first pass re-scored from the float32 spool
+        rescore = rescore_candidates if is_quantized(index) else 0
+        report = evaluate_index(index, vectors, ids=all_ids, k=eval_k, n_queries=eval_queries,
+                                rescore_candidates=rescore)
+
+    # Spool first: a query process that reloads for the new index then finds
+    # the matching spool, while one still on the old index keeps its old memmap
+    spool.commit()
+    write_index_atomic(index, FAISS_INDEX_PATH)
+    storage = storage_report(index, FAISS_INDEX_PATH)
+    if report is not None:
+        report.update(storage)
+    return total, report
+
+def delete_document(title):
+    # Removes a document's chunks from both the FAISS index and PostgreSQL
+    cur.execute("SELECT id FROM chunks WHERE title = %s", (title,))
+    ids = [r[0] for r in cur.fetchall()]
+    if not ids:
+        return 0
+    if os.path.exists(FAISS_INDEX_PATH):
+        index = faiss.read_index(FAISS_INDEX_PATH)
+        removed = remove_ids(index, ids)
+        if os.path.exists(f"{VECTOR_SPOOL_PATH}.ids"):
+            # Keeps the rescoring spool in step with the index
+            pruned = prune_spool(VECTOR_SPOOL_PATH, EMBED_DIM, ids)
+            logging.info(f"🗑️ Pruned {pruned} vectors from the spool")
+        write_index_atomic(index, FAISS_INDEX_PATH)
+        logging.info(f"🗑️ Removed {removed} vectors from FAISS index")
+    cur.execute("DELETE FROM chunks WHERE id = ANY(%s)", (ids,))
     conn.commit()
-    return ids
+    return len(ids)
 
-def build_faiss(chunks, ids):
-    texts = [f"passage: {c['content']}" for c in chunks]
-    embeddings = model.encode(texts, normalize_embeddings=True).astype('float32')
-    index = faiss.IndexFlatIP(EMBED_DIM)
-    index.add(embeddings)
-    faiss.write_index(index, FAISS_INDEX_PATH)
-    with open(ID_MAP_PATH, "wb") as f:
-        pickle.dump(ids, f)
+def document_exists(title):
+    cur.execute("SELECT 1 FROM chunks WHERE title = %s LIMIT 1", (title,))
+    return cur.fetchone() is not None
+
+def close_db():
+    # Closing an unused Lazy proxy would open a connection just to close it
+    if cur.loaded:
+        cur.close()
+    if conn.loaded:
+        conn.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chunk a PDF into PostgreSQL and build its FAISS index.")
+    parser.add_argument("pdf_path", nargs="?", default="yourfile.pdf")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default ~4·sqrt(n))")
+    parser.add_argument("--m", type=int, default=32, help="HNSW neighbours per node")
+    parser.add_argument("--pq-m", type=int, default=None, help="IVF-PQ sub-quantizers")
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--eval-k", type=int, default=10, help="k for the recall@k report")
+    parser.add_argument("--eval-queries", type=int, default=200, help="0 disables the report")
+    parser.add_argument("--rescore-candidates", type=int, default=FAISS_RESCORE_CANDIDATES,
+                        help="hits re-scored in float32 when evaluating SQ/PQ indexes")
+    parser.add_argument("--batch-size", type=int, default=BUILD_BATCH_SIZE,
+                        help="chunks embedded and indexed per step")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="build a new index instead of appending to the existing one")
+    parser.add_argument("--delete", action="store_true",
+                        help="remove this PDF's chunks from the index and database")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    PDF_PATH = "yourfile.pdf"
-    chunks = chunk_pdf(PDF_PATH)
-    print(f"[+] Extracted {len(chunks)} chunks")
-    ids = insert_metadata(chunks)
-    print("[+] Inserted into PostgreSQL")
-    build_faiss(chunks, ids)
+    args = parse_args()
+    if args.delete:
+        removed = delete_document(os.path.basename(args.pdf_path))
+        print(f"[+] Deleted {removed} chunks")
+        close_db()
+        raise SystemExit(0)
+
+    # Appending the same PDF again would duplicate its rows and vectors
+    title = os.path.basename(args.pdf_path)
+    if document_exists(title):
+        if not args.rebuild:
+            close_db()
+            raise RuntimeError(
+                f"{title} is already indexed; remove it first with build_index.py --delete "
+                "or start over with --rebuild"
+            )
+        # A rebuild replaces the index, so only the old rows need to go
+        cur.execute("DELETE FROM chunks WHERE title = %s", (title,))
+        conn.commit()
+
+    total, _ = build_faiss(
+        iter_chunks(args.pdf_path),
+        index_type=args.index_type, nlist=args.nlist, m=args.m, pq_m=args.pq_m,
+        ef_construction=args.ef_construction, ef_search=args.ef_search, nprobe=args.nprobe,
+        eval_k=args.eval_k, eval_queries=args.eval_queries, rebuild=args.rebuild,
+        batch_size=args.batch_size, rescore_candidates=args.rescore_candidates,
+    )
+    print(f"[+] Inserted {total} chunks into PostgreSQL")
     print("[+] FAISS index saved to HDD")
-    cur.close()
-    conn.close()
\ No newline at end of file
+    close_db()
@@ -0,0 +1,230 @@
+import os
+import re
+import uuid
+import struct
+import logging
+from datetime import datetime, timedelta, timezone
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+# Rows buffered by add() before a COPY is issued
+BULK_FLUSH_ROWS = int(os.getenv("BULK_FLUSH_ROWS", "5000"))
+# Size of each piece of the COPY stream handed to the driver
+BULK_COPY_BUFFER_BYTES = int(os.getenv("BULK_COPY_BUFFER_BYTES", str(1 << 20)))
+# Set to "text" to force text COPY even when every column has a binary encoder
+BULK_COPY_FORMAT = os.getenv("BULK_COPY_FORMAT", "auto")
+
+# ────────────────────────────────────────────────
+# TEXT COPY ENCODING
+# ────────────────────────────────────────────────
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def _text_field(value):
+    if value is None:
+        return "\\N"
+    if hasattr(value, "tolist"):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(map(str, value)) + "]"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value).translate(_TEXT_ESCAPES)
+
+def _text_row(row):
+    return ("\t".join(_text_field(v) for v in row) + "\n").encode("utf-8")
+
+# ────────────────────────────────────────────────
+# BINARY COPY ENCODING
+# ────────────────────────────────────────────────
+_PG_EPOCH = datetime(2000, 1, 1)
+_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_BINARY_TRAILER = struct.pack("!h", -1)
+
+def _timestamp(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return struct.pack("!q", (value - _PG_EPOCH) // timedelta(microseconds=1))
+
+def _vector(value):
+    if hasattr(value, "tolist"):
+        value = value.tolist()
+    return struct.pack(f"!HH{len(value)}f", len(value), 0, *value)
+
+_BINARY_ENCODERS = {
+    "text": lambda v: str(v).encode("utf-8"),
+    "smallint": struct.Struct("!h").pack,
+    "integer": struct.Struct("!i").pack,
+    "bigint": struct.Struct("!q").pack,
+    "real": struct.Struct("!f").pack,
+    "double precision": struct.Struct("!d").pack,
+    "boolean": lambda v: b"\x01" if v else b"\x00",
+    "uuid": lambda v: uuid.UUID(str(v)).bytes,
+    "timestamp without time zone": _timestamp,
+    "timestamp with time zone": _timestamp,
+    "vector": _vector,
+}
+
+def _binary_encoder(pg_type):
+    base = re.sub(r"\(.*\)", "", pg_type).strip()
+    if base in ("character varying", "character"):
+        base = "text"
+    return _BINARY_ENCODERS.get(base)
+
+def _binary_row(row, encoders):
+    parts = [struct.pack("!h", len(row))]
+    for value, encode in zip(row, encoders):
+        if value is None:
+            parts.append(struct.pack("!i", -1))
+        else:
+            data = encode(value)
+            parts.append(struct.pack("!i", len(data)))
+            parts.append(data)
+    return b"".join(parts)
+
+# ────────────────────────────────────────────────
+# STREAMING SOURCE
+# ────────────────────────────────────────────────
+class _CopyStream:
+    # File-like object that encodes rows lazily, so a large COPY never has to
+    # be materialised in memory.
+    def __init__(self, rows, encode, header=b"", trailer=b""):
+        self.pieces = self._pieces(rows, encode, header, trailer)
+        self.buffer = b""
+
+    @staticmethod
+    def _pieces(rows, encode, header, trailer):
+        if header:
+            yield header
+        for row in rows:
+            yield encode(row)
+        if trailer:
+            yield trailer
+
+    def read(self, size=BULK_COPY_BUFFER_BYTES):
+        if size is None or size < 0:
+            size = BULK_COPY_BUFFER_BYTES
+        parts, length = [self.buffer], len(self.buffer)
+        while length < size:
+            piece = next(self.pieces, None)
+            if piece is None:
+                break
+            parts.append(piece)
+            length += len(piece)
+        data = b"".join(parts)
+        self.buffer = data[size:]
+        return data[:size]
+
+    def chunks(self):
+        while True:
+            data = self.read()
+            if not data:
+                return
+            yield data
+
+# ────────────────────────────────────────────────
+# BULK WRITER
+# ────────────────────────────────────────────────
+class BulkWriter:
+    """Streams rows into a table with COPY, one transaction per write/flush.
+
+    `conn` is either a SQLAlchemy engine (a pooled connection is borrowed per
+    transaction) or an open DB-API connection. When `id_column` is set, ids are
+    reserved from the column's sequence up front so COPY can still hand back
+    the generated ids, in row order.
+    """
+
+    def __init__(self, conn, table, columns, id_column=None, flush_rows=BULK_FLUSH_ROWS,
+                 copy_format=BULK_COPY_FORMAT):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        self.id_column = id_column
+        self.flush_rows = flush_rows
+        self.copy_format = copy_format
+        self.pending = []
+        self.encoders = None
+
+    def add(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.flush_rows:
+            return self.flush()
+        return []
+
+    def flush(self):
+        rows, self.pending = self.pending, []
+        return self.write(rows)
+
+    def write(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        dbapi_conn, owned = self._connection()
+        try:
+            cur = dbapi_conn.cursor()
+            ids = self._reserve_ids(cur, len(rows)) if self.id_column else []
+            if ids:
+                rows = [(row_id, *row) for row_id, row in zip(ids, rows)]
+            self._copy(cur, rows)
+            dbapi_conn.commit()
+            cur.close()
+        except Exception:
+            dbapi_conn.rollback()
+            raise
+        finally:
+            if owned:
+                dbapi_conn.close()
+        return ids
+
+    def _connection(self):
+        if hasattr(self.conn, "raw_connection"):
+            return self.conn.raw_connection(), True
+        return self.conn, False
+
+    def _all_columns(self):
+        return ([self.id_column] if self.id_column else []) + self.columns
+
+    def _reserve_ids(self, cur, n):
+        cur.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+            (self.table, self.id_column, n),
+        )
+        return [r[0] for r in cur.fetchall()]
+
+    def _load_encoders(self, cur):
+        # Binary COPY needs the exact column types; fall back to text COPY
+        # as soon as one column has a type we can't encode.
+        if self.copy_format == "text":
+            return []
+        cur.execute("""
+            SELECT attname, format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        """, (self.table,))
+        types = dict(cur.fetchall())
+        encoders = [_binary_encoder(types.get(col, "")) for col in self._all_columns()]
+        if not all(encoders):
+            logging.info(f"📦 COPY into {self.table} will use text format")
+            return []
+        return encoders
+
+    def _copy(self, cur, rows):
+        if self.encoders is None:
+            self.encoders = self._load_encoders(cur)
+        columns = ", ".join(self._all_columns())
+        if self.encoders:
+            sql = f"COPY {self.table} ({columns}) FROM STDIN WITH (FORMAT binary)"
+            stream = _CopyStream(rows, lambda row: _binary_row(row, self.encoders),
+                                 _BINARY_HEADER, _BINARY_TRAILER)
+        else:
+            sql = f"COPY {self.table} ({columns}) FROM STDIN"
+            stream = _CopyStream(rows, _text_row)
+
+        if hasattr(cur, "copy_expert"):  # psycopg2
+            cur.copy_expert(sql, stream, size=BULK_COPY_BUFFER_BYTES)
+        else:  # psycopg 3
+            with cur.copy(sql) as copy:
+                for data in stream.chunks():
+                    copy.write(data)
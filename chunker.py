@@ -0,0 +1,84 @@
+import os
+from functools import lru_cache
+import tiktoken
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+# ~700 / ~100 characters, the old RecursiveCharacterTextSplitter settings
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "175"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "25"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "10"))
+# How far back from a window's end to look for a line/sentence break
+CHUNK_SNAP_TOKENS = int(os.getenv("CHUNK_SNAP_TOKENS", "32"))
+
+# ────────────────────────────────────────────────
+# CACHED ENCODERS
+# ────────────────────────────────────────────────
+@lru_cache(maxsize=None)
+def get_encoding(name="cl100k_base"):
+    # Building an encoding parses its whole BPE table; do it once per process
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=None)
+def encoding_for_model(model):
+    # Azure deployment names (e.g. gpt-35-turbo) aren't known to tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return get_encoding("cl100k_base")
+
+
+# ────────────────────────────────────────────────
+# TOKEN WINDOW CHUNKING
+# ────────────────────────────────────────────────
+def _is_break(token_bytes):
+    return token_bytes.endswith((b"\n", b". ", b".", b"?", b"!"))
+
+
+def _is_blank(token_bytes):
+    return not token_bytes.strip()
+
+
+def chunk_tokens(tokens, encoding, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP_TOKENS,
+                 min_tokens=CHUNK_MIN_TOKENS, snap=CHUNK_SNAP_TOKENS):
+    """Cuts an already-encoded document into overlapping token windows.
+
+    Each window ends on the last line or sentence break within its final
+    `snap` tokens when there is one. Returns (text, token_count) pairs;
+    token_count is the length of the window, so it never needs recounting.
+    """
+    chunks = []
+    n = len(tokens)
+    start = 0
+    step_floor = max(1, chunk_tokens - overlap)
+    while start < n:
+        end = min(start + chunk_tokens, n)
+        if end < n:
+            for j in range(end - 1, max(start + step_floor, end - snap) - 1, -1):
+                if _is_break(encoding.decode_single_token_bytes(tokens[j])):
+                    end = j + 1
+                    break
+
+        # Whitespace-only tokens at the edges add nothing to the chunk
+        lo, hi = start, end
+        while lo < hi and _is_blank(encoding.decode_single_token_bytes(tokens[lo])):
+            lo += 1
+        while hi > lo and _is_blank(encoding.decode_single_token_bytes(tokens[hi - 1])):
+            hi -= 1
+        if hi - lo >= min_tokens:
+            # A window edge can split a multi-byte character; drop the stray halves
+            text = encoding.decode(tokens[lo:hi]).strip().strip("�")
+            chunks.append((text, hi - lo))
+
+        if end >= n:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def chunk_text(text, encoding=None, **options):
+    # Tokenizes the document once, then windows the tokens
+    encoding = encoding or get_encoding()
+    return chunk_tokens(encoding.encode_ordinary(text), encoding, **options)
@@ -0,0 +1,118 @@
+import os
+import logging
+from chunker import CHUNK_OVERLAP_TOKENS
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+# Tokens of retrieved context per prompt; the default leaves room for the
+# template and question below select_model's gpt-4o threshold
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1400"))
+# Shorter shared runs are treated as coincidence, not splitter overlap
+MIN_OVERLAP_CHARS = 16
+# A passage cut to fit the budget must keep at least this many tokens
+MIN_TRUNCATED_TOKENS = 48
+PASSAGE_SEPARATOR = "\n\n"
+
+# ────────────────────────────────────────────────
+# MERGING
+# ────────────────────────────────────────────────
+def overlap_bound(text, encoding, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    # Ingest windows share at most `overlap_tokens` tokens, so that many
+    # leading tokens of a chunk are all it can repeat from the one before
+    return len(encoding.decode(encoding.encode_ordinary(text)[:overlap_tokens]))
+
+
+def overlap_length(left, right, max_chars):
+    # Longest suffix of `left` that is also a prefix of `right`, up to `max_chars`
+    for k in range(min(len(left), len(right), max_chars), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:k]):
+            return k
+    return 0
+
+
+def merge_adjacent(hits, encoding):
+    """Joins consecutive chunks of the same document into passages.
+
+    `hits` are (doc_key, chunk_index, text, rank) tuples, lower rank being
+    better. Returns (text, rank, members) per passage, where rank is the best
+    of its chunks and members are the positions in `hits` it covers. Texts
+    already taken from another document are dropped, and at each join only
+    the ingest overlap (at most the next chunk's first CHUNK_OVERLAP_TOKENS
+    tokens) is removed.
+    """
+    seen = {}
+    rows = set()
+    by_doc = {}
+    for pos, (doc_key, chunk_index, text, rank) in enumerate(hits):
+        # Repeats within one document are real content (e.g. boilerplate),
+        # so only a text already taken from another document is dropped
+        row = (doc_key, chunk_index, text)
+        if seen.setdefault(text, doc_key) != doc_key or row in rows:
+            continue
+        rows.add(row)
+        by_doc.setdefault(doc_key, []).append((chunk_index, pos, text, rank))
+
+    passages = []
+    for chunks in by_doc.values():
+        chunks.sort(key=lambda c: (c[0] is None, c[0]))
+        current = None
+        for chunk_index, pos, text, rank in chunks:
+            if current is not None and chunk_index is not None and current["last"] is not None \
+                    and chunk_index == current["last"] + 1:
+                cut = overlap_length(current["text"], text, overlap_bound(text, encoding))
+                current["text"] += text[cut:] if cut else "\n" + text
+                current["rank"] = min(current["rank"], rank)
+                current["members"].append(pos)
+                current["last"] = chunk_index
+                continue
+            if current is not None:
+                passages.append(current)
+            current = {"text": text, "rank": rank, "members": [pos], "last": chunk_index}
+        if current is not None:
+            passages.append(current)
+
+    passages.sort(key=lambda p: p["rank"])
+    return [(p["text"], p["rank"], p["members"]) for p in passages]
+
+# ────────────────────────────────────────────────
+# PACKING
+# ────────────────────────────────────────────────
+def pack_context(hits, encoding, budget=CONTEXT_TOKEN_BUDGET):
+    """Builds the prompt context from retrieved chunks within a token budget.
+
+    Adjacent chunks are merged, passages are ordered best-first and added
+    until `budget` tokens are used; the first passage that doesn't fit is
+    cut at a token boundary if enough room is left. Every passage is
+    tokenized once (one encode_batch call), plus the head of each chunk
+    joined onto another. Returns
+    (context, token_count, used) where `used` lists the positions in `hits`
+    that made it into the context.
+    """
+    passages = merge_adjacent(hits, encoding)
+    if not passages:
+        return "", 0, []
+
+    tokens = encoding.encode_batch([text for text, _, _ in passages])
+    separator_tokens = len(encoding.encode(PASSAGE_SEPARATOR))
+
+    parts, used, total = [], [], 0
+    for (text, _, members), passage_tokens in zip(passages, tokens):
+        cost = len(passage_tokens) + (separator_tokens if parts else 0)
+        if total + cost <= budget:
+            parts.append(text)
+            used.extend(members)
+            total += cost
+            continue
+        room = budget - total - (separator_tokens if parts else 0)
+        if room >= MIN_TRUNCATED_TOKENS:
+            parts.append(encoding.decode(passage_tokens[:room]))
+            used.extend(members)
+            total += room + (separator_tokens if len(parts) > 1 else 0)
+        break
+
+    logging.info(
+        f"🧩 Packed {len(used)}/{len(hits)} chunks into {len(parts)} passages: "
+        f"{total} context tokens (budget {budget})"
+    )
+    return PASSAGE_SEPARATOR.join(parts), total, sorted(used)
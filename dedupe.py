@@ -0,0 +1,100 @@
+import os
+import math
+import logging
+from sqlalchemy import text
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+# "set" keeps every known hash in memory; "bloom" trades a small false-positive
+# rate (resolved against the DB) for a fixed, much smaller footprint.
+DEDUPE_MODE = os.getenv("DEDUPE_MODE", "set")
+BLOOM_EXPECTED_ITEMS = int(os.getenv("BLOOM_EXPECTED_ITEMS", "10000000"))
+BLOOM_FP_RATE = float(os.getenv("BLOOM_FP_RATE", "0.001"))
+
+# ────────────────────────────────────────────────
+# BLOOM FILTER
+# ────────────────────────────────────────────────
+class BloomFilter:
+    # Keys are sha256 hex digests, so slices of the digest are already uniform
+    # and can be used directly as the k hash functions.
+    def __init__(self, expected_items=BLOOM_EXPECTED_ITEMS, fp_rate=BLOOM_FP_RATE):
+        self.size = max(8, int(-expected_items * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, min(8, round(self.size / expected_items * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        for i in range(self.hashes):
+            yield int(key[i * 8:(i + 1) * 8], 16) % self.size
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+# ────────────────────────────────────────────────
+# CHUNK HASH INDEX
+# ────────────────────────────────────────────────
+class ChunkHashIndex:
+    def __init__(self, engine, table="documents", mode=DEDUPE_MODE):
+        self.engine = engine
+        self.table = table
+        self.mode = mode
+        self.known = BloomFilter() if mode == "bloom" else set()
+        self.added = set()  # hashes queued during this run
+        self.warmed = False
+        self.db_checks = 0
+
+    def warm(self):
+        count = 0
+        with self.engine.connect() as conn:
+            rows = conn.execution_options(stream_results=True, yield_per=50000).execute(
+                text(f"SELECT chunk_hash FROM {self.table} WHERE chunk_hash IS NOT NULL")
+            )
+            for (chunk_hash,) in rows:
+                self.known.add(chunk_hash)
+                count += 1
+        self.warmed = True
+        logging.info(f"🧠 Warmed {self.mode} dedupe index with {count} chunk hashes")
+        return self
+
+    def add(self, hashes):
+        for h in hashes:
+            self.known.add(h)
+            self.added.add(h)
+
+    def discard(self, hashes):
+        # Bloom filters can't forget; a removed hash just costs one DB check later
+        if isinstance(self.known, set):
+            self.known.difference_update(hashes)
+        self.added.difference_update(hashes)
+
+    def filter_new(self, hashes):
+        # Returns the hashes not yet stored, in order and without repeats.
+        # A warmed set is authoritative; Bloom hits (or an unwarmed index) are
+        # resolved with a single ANY() query for the whole batch.
+        unique = [h for h in dict.fromkeys(hashes) if h not in self.added]
+        if self.mode == "set":
+            candidates = [h for h in unique if h not in self.known]
+            if self.warmed:
+                return candidates
+        else:
+            # Bloom negatives are definitely new; only positives need confirming
+            maybe = [h for h in unique if h in self.known] if self.warmed else unique
+            stored = self._lookup(maybe)
+            return [h for h in unique if h not in stored]
+        stored = self._lookup(candidates)
+        return [h for h in candidates if h not in stored]
+
+    def _lookup(self, hashes):
+        if not hashes:
+            return set()
+        self.db_checks += 1
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT chunk_hash FROM {self.table} WHERE chunk_hash = ANY(:hashes)"),
+                {"hashes": hashes},
+            )
+            return {r[0] for r in rows}
@@ -0,0 +1,162 @@
+import os
+import time
+import hashlib
+import logging
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Cap on characters per batch so a run of long chunks doesn't blow up padding/RAM
+EMBED_MAX_BATCH_CHARS = int(os.getenv("EMBED_MAX_BATCH_CHARS", "64000"))
+# 0 = auto: only spread encode over processes on big CPU boxes
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "0"))
+EMBED_POOL_MIN_CPUS = 16
+EMBED_THREADS_PER_WORKER = 8
+
+
+def auto_workers():
+    if EMBED_WORKERS:
+        return EMBED_WORKERS
+    cpus = os.cpu_count() or 1
+    if cpus < EMBED_POOL_MIN_CPUS:
+        return 1
+    return cpus // EMBED_THREADS_PER_WORKER
+
+class EmbeddingBatchError(Exception):
+    """A flushed batch failed to encode; `payloads` are the items it held."""
+
+    def __init__(self, payloads, cause):
+        super().__init__(f"{len(payloads)} chunks failed to embed: {cause}")
+        self.payloads = payloads
+
+# ────────────────────────────────────────────────
+# THROUGHPUT REPORTING
+# ────────────────────────────────────────────────
+class ThroughputMeter:
+    def __init__(self):
+        self.chunks = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def record(self, n_chunks, seconds):
+        self.chunks += n_chunks
+        self.batches += 1
+        self.seconds += seconds
+
+    @property
+    def rate(self):
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def log(self):
+        logging.info(
+            f"⚡ Embedded {self.chunks} chunks in {self.batches} batches "
+            f"({self.seconds:.1f}s encode, {self.rate:.1f} chunks/sec)"
+        )
+
+# ────────────────────────────────────────────────
+# BATCHED EMBEDDING
+# ────────────────────────────────────────────────
+class EmbeddingBatcher:
+    """Collects chunks across files and encodes them in size-tuned batches.
+
+    `add()` returns the (payload, embedding) pairs of any batch it had to flush,
+    so callers can store them as they come out. With an EmbeddingCache, texts
+    already embedded by this model are served from disk and never encoded.
+    """
+
+    def __init__(self, model, batch_size=EMBED_BATCH_SIZE, max_batch_chars=EMBED_MAX_BATCH_CHARS,
+                 workers=None, prefix="", cache=None):
+        self.model = model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_batch_chars = max_batch_chars
+        self.prefix = prefix
+        self.pending = []
+        self.pending_chars = 0
+        self.meter = ThroughputMeter()
+        self.workers = workers if workers is not None else auto_workers()
+        self.pool = None
+        if self.workers > 1:
+            logging.info(f"🧵 Starting {self.workers}-process encode pool")
+            self.pool = model.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+
+    def add(self, text, payload):
+        self.pending.append((payload, self.prefix + text))
+        self.pending_chars += len(text)
+        # With a pool we gather one batch per worker before encoding
+        target = self.batch_size * max(self.workers, 1)
+        if len(self.pending) >= target or self.pending_chars >= self.max_batch_chars * max(self.workers, 1):
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self.pending:
+            return []
+        # Sorting by length keeps similar-sized chunks together and cuts padding waste
+        items = sorted(self.pending, key=lambda item: len(item[1]))
+        self.pending = []
+        self.pending_chars = 0
+
+        texts = [t for _, t in items]
+        keys = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in texts]
+        try:
+            cached = self.cache.get_many(keys) if self.cache is not None else {}
+            todo = [i for i, k in enumerate(keys) if k not in cached]
+
+            vectors = {}
+            if todo:
+                start = time.perf_counter()
+                encoded = self._encode([texts[i] for i in todo])
+                self.meter.record(len(todo), time.perf_counter() - start)
+                vectors = dict(zip(todo, encoded))
+                if self.cache is not None:
+                    self.cache.put_many([keys[i] for i in todo], encoded)
+        except Exception as e:
+            # pending is already cleared; hand the payloads back so callers can retry them
+            raise EmbeddingBatchError([payload for payload, _ in items], e) from e
+
+        return [
+            (payload, (vectors[i] if i in vectors else cached[keys[i]]).tolist())
+            for i, (payload, _) in enumerate(items)
+        ]
+
+    def _encode(self, texts):
+        if self.pool is not None:
+            return self.model.encode_multi_process(
+                texts, self.pool, batch_size=self.batch_size, normalize_embeddings=True
+            )
+        vectors = []
+        for batch in self._char_bounded(texts):
+            vectors.extend(self.model.encode(batch, batch_size=len(batch), normalize_embeddings=True))
+        return vectors
+
+    def _char_bounded(self, texts):
+        batch, chars = [], 0
+        for t in texts:
+            if batch and (len(batch) >= self.batch_size or chars + len(t) > self.max_batch_chars):
+                yield batch
+                batch, chars = [], 0
+            batch.append(t)
+            chars += len(t)
+        if batch:
+            yield batch
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+        if self.cache is not None:
+            self.cache.log_stats()
+
+
+def embed_texts(batcher, texts):
+    # Embeds a list of texts through the batcher, returning vectors in input order
+    embedded = []
+    for i, t in enumerate(texts):
+        embedded.extend(batcher.add(t, i))
+    embedded.extend(batcher.flush())
+    vectors = [None] * len(texts)
+    for i, vec in embedded:
+        vectors[i] = vec
+    return vectors
@@ -0,0 +1,156 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+import numpy as np
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+EMBED_CACHE_DIR = os.getenv(
+    "EMBED_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "ragtoriches", "embeddings"),
+)
+# Per-model budget for the vector file; least recently used slots are reused past it
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(4 << 30)))
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") == "1"
+
+_SQL_BATCH = 500  # stay under SQLite's bound-parameter limit
+
+# ────────────────────────────────────────────────
+# EMBEDDING CACHE
+# ────────────────────────────────────────────────
+class EmbeddingCache:
+    """On-disk cache of embeddings keyed by (model name, chunk hash).
+
+    Vectors live in a fixed-capacity float32 memmap per model; a small SQLite
+    table maps chunk hashes to slots and tracks last use for LRU eviction.
+    """
+
+    def __init__(self, model_name, root=EMBED_CACHE_DIR, max_bytes=EMBED_CACHE_MAX_BYTES):
+        self.model_name = model_name
+        self.dir = os.path.join(root, re.sub(r"[^a-zA-Z0-9_\-.]", "_", model_name))
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.dir, "index.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS slots (
+                chunk_hash TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS slots_last_used ON slots (last_used)")
+        self.db.commit()
+
+        meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        if "dim" in meta:
+            self._open(meta["dim"], meta["capacity"])
+
+    def _open(self, dim, capacity, create=False):
+        path = os.path.join(self.dir, "vectors.f32")
+        mode = "w+" if create else "r+"
+        self.vectors = np.memmap(path, dtype="float32", mode=mode, shape=(capacity, dim))
+        self.dim = dim
+        self.capacity = capacity
+
+    def _create(self, dim):
+        capacity = max(1, self.max_bytes // (dim * 4))
+        self.db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                            [("dim", dim), ("capacity", capacity)])
+        self.db.execute("DELETE FROM slots")
+        self.db.commit()
+        self._open(dim, capacity, create=True)
+
+    def get_many(self, hashes):
+        # Returns {hash: vector} for the hashes present in the cache
+        if self.vectors is None or not hashes:
+            self.misses += len(hashes)
+            return {}
+        found = {}
+        with self.lock:
+            for i in range(0, len(hashes), _SQL_BATCH):
+                part = hashes[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(part))
+                found.update(self.db.execute(
+                    f"SELECT chunk_hash, slot FROM slots WHERE chunk_hash IN ({marks})", part
+                ))
+            if found:
+                now = time.time()
+                self.db.executemany("UPDATE slots SET last_used = ? WHERE chunk_hash = ?",
+                                    [(now, h) for h in found])
+                self.db.commit()
+            result = {h: np.array(self.vectors[slot]) for h, slot in found.items()}
+        self.hits += len(result)
+        self.misses += len(hashes) - len(result)
+        return result
+
+    def put_many(self, hashes, vectors):
+        if not hashes:
+            return
+        vectors = np.asarray(vectors, dtype="float32")
+        with self.lock:
+            if self.vectors is None or self.vectors.shape[1] != vectors.shape[1]:
+                self._create(vectors.shape[1])
+            # Overwrite existing entries in place so slots stay densely packed
+            new = dict(zip(hashes, vectors))
+            existing = {}
+            for i in range(0, len(hashes), _SQL_BATCH):
+                part = hashes[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(part))
+                existing.update(self.db.execute(
+                    f"SELECT chunk_hash, slot FROM slots WHERE chunk_hash IN ({marks})", part
+                ))
+            now = time.time()
+            # Touch existing entries first so eviction can't hand their slots out
+            self.db.executemany("UPDATE slots SET last_used = ? WHERE chunk_hash = ?",
+                                [(now, h) for h in existing])
+            missing = [h for h in new if h not in existing]
+            placed = dict(existing)
+            placed.update(zip(missing, self._allocate(len(missing))))
+
+            for h, slot in placed.items():
+                self.vectors[slot] = new[h]
+            self.db.executemany(
+                "INSERT OR REPLACE INTO slots (chunk_hash, slot, last_used) VALUES (?, ?, ?)",
+                [(h, slot, now) for h, slot in placed.items()],
+            )
+            self.db.commit()
+            self.vectors.flush()
+
+    def _allocate(self, n):
+        # Slots are handed out densely from 0, so the row count is the next free slot
+        used = self.db.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+        fresh = list(range(used, min(used + n, self.capacity)))
+        wanted = min(n, self.capacity) - len(fresh)
+        if wanted <= 0:
+            return fresh
+        # Evict least recently used entries and reuse their slots
+        evicted = self.db.execute(
+            "SELECT chunk_hash, slot FROM slots ORDER BY last_used LIMIT ?", (wanted,)
+        ).fetchall()
+        self.db.executemany("DELETE FROM slots WHERE chunk_hash = ?", [(h,) for h, _ in evicted])
+        logging.info(f"🧹 Embedding cache evicted {len(evicted)} entries for {self.model_name}")
+        return fresh + [slot for _, slot in evicted]
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        logging.info(f"💾 Embedding cache {self.model_name}: {self.hits}/{total} hits ({rate:.1%})")
+
+    def close(self):
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.db.close()
+
+
+def open_cache(model_name):
+    return EmbeddingCache(model_name) if EMBED_CACHE_ENABLED else None
@@ -0,0 +1,410 @@
+import os
+import time
+import pickle
+import logging
+import threading
+import numpy as np
+import faiss
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+# How often (seconds) a query may stat the index file to look for a new build
+FAISS_RELOAD_CHECK_SECONDS = float(os.getenv("FAISS_RELOAD_CHECK_SECONDS", "2"))
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "ivfsq8", "sq8", "sqfp16", "pq", "hnswsq8")
+# FAISS recommends ~39+ training points per IVF list; cap the sample for big corpora
+TRAIN_POINTS_PER_LIST = 64
+TRAIN_SAMPLE_MAX_BYTES = int(os.getenv("TRAIN_SAMPLE_MAX_BYTES", str(256 << 20)))
+# Rows per block when scanning spooled vectors (adding, ground truth)
+SCAN_BLOCK_ROWS = 8192
+# Query-time overrides for the values saved with the index (0 = keep saved)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "0"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "0"))
+# Hits taken from a quantized (SQ/PQ) index and re-scored with spooled float32 vectors
+FAISS_RESCORE_CANDIDATES = int(os.getenv("FAISS_RESCORE_CANDIDATES", "100"))
+
+# ────────────────────────────────────────────────
+# ATOMIC WRITES
+# ────────────────────────────────────────────────
+def write_index_atomic(index, path):
+    # Readers only ever see a complete file: write beside it, then rename over
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_index(path, mmap=True):
+    if mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Not every index type can be memory-mapped; fall back to a normal load
+            pass
+    return faiss.read_index(path)
+
+# ────────────────────────────────────────────────
+# INDEX BUILDING
+# ────────────────────────────────────────────────
+def default_nlist(n_vectors):
+    # ~4·sqrt(n) lists, but keep enough vectors per list to train the centroids
+    return max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+
+
+def make_index(kind, dim, nlist=None, m=32, pq_m=None, ef_construction=200, n_vectors=None):
+    # All index types use inner product, which is cosine on normalized embeddings
+    metric = faiss.METRIC_INNER_PRODUCT
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, m, metric)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    # Compact codes without IVF: 1 byte/dim, 2 bytes/dim, or pq_m bytes per vector
+    if kind == "sq8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, metric)
+    if kind == "sqfp16":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, metric)
+    if kind == "pq":
+        return faiss.IndexPQ(dim, pq_m or _default_pq_m(dim), 8, metric)
+    if kind == "hnswsq8":
+        index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, m, metric)
+        index.hnsw.efConstruction = ef_construction
+        return index
+
+    nlist = nlist or default_nlist(n_vectors or 1)
+    quantizer = faiss.IndexFlatIP(dim)
+    if kind == "ivf":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+    if kind == "ivfsq8":
+        return faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit, metric)
+    if kind == "ivfpq":
+        # pq_m sub-quantizers of 8 bits each; dim must divide evenly
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m or _default_pq_m(dim), 8, metric)
+    raise ValueError(f"Unknown index type: {kind} (expected one of {', '.join(INDEX_TYPES)})")
+
+
+def _default_pq_m(dim):
+    # Largest common sub-quantizer count that divides dim evenly
+    return next(d for d in (64, 48, 32, 16, 8, 4, 2, 1) if dim % d == 0)
+
+
+def is_quantized(index):
+    # True when stored codes are lossy, i.e. search results are worth re-scoring
+    base = faiss.downcast_index(index.index if is_id_mapped(index) else index)
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    return not isinstance(base, (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+
+def storage_report(index, path):
+    # Index file size against the raw float32 vectors it holds
+    full_bytes = index.ntotal * index.d * 4
+    index_bytes = os.path.getsize(path)
+    saved = 1 - index_bytes / full_bytes if full_bytes else 0.0
+    logging.info(
+        f"💾 Index {index_bytes / 2**20:.1f} MiB vs {full_bytes / 2**20:.1f} MiB of float32 vectors "
+        f"({saved:.0%} saved)"
+    )
+    return {"index_bytes": index_bytes, "full_bytes": full_bytes, "saved": saved}
+
+
+def with_ids(index):
+    # Vectors are stored under their Postgres chunks.id, so no side id map is needed
+    return faiss.IndexIDMap2(index)
+
+
+def is_id_mapped(index):
+    return isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+
+def add_with_ids(index, vectors, ids):
+    index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"), np.asarray(ids, dtype="int64"))
+
+
+def remove_ids(index, ids):
+    try:
+        return index.remove_ids(faiss.IDSelectorBatch(np.asarray(ids, dtype="int64")))
+    except RuntimeError as e:
+        # HNSW graphs can't drop nodes; those indexes need a rebuild instead
+        base = faiss.downcast_index(index.index if is_id_mapped(index) else index)
+        raise RuntimeError(f"{type(base).__name__} does not support deletes; rebuild the index") from e
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    # ParameterSpace reaches through wrappers such as IndexIDMap
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if not value:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass  # parameter doesn't apply to this index type
+
+
+def train_index(index, vectors, seed=0):
+    if index.is_trained:
+        return
+    n, dim = vectors.shape
+    nlist = getattr(faiss.try_extract_index_ivf(index), "nlist", 1)
+    max_sample = max(nlist, TRAIN_SAMPLE_MAX_BYTES // (dim * 4))
+    sample_size = min(n, max_sample, max(nlist * TRAIN_POINTS_PER_LIST, 10000))
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n, size=sample_size, replace=False))
+    start = time.perf_counter()
+    index.train(np.ascontiguousarray(vectors[sample], dtype="float32"))
+    logging.info(f"🏋️ Trained index on {sample_size} of {n} vectors in {time.perf_counter() - start:.1f}s")
+
+def add_in_blocks(index, vectors, ids, block_rows=SCAN_BLOCK_ROWS):
+    # Adds memmapped vectors a block at a time so they never all sit in RAM
+    for start in range(0, len(vectors), block_rows):
+        add_with_ids(index, vectors[start:start + block_rows], ids[start:start + block_rows])
+
+# ────────────────────────────────────────────────
+# VECTOR SPOOL
+# ────────────────────────────────────────────────
+class VectorSpool:
+    """Append-only on-disk store of full-precision vectors and their ids.
+
+    Embedding batches are written as they are produced and read back as
+    memmaps, so building an index never needs the whole matrix in memory.
+    A fresh spool is written beside the live files and swapped in by
+    commit(), so a query process with the old spool memory-mapped never
+    sees it truncated. Appends only grow the live files, which is safe.
+    """
+
+    def __init__(self, path, dim, append=False):
+        self.path = path
+        self.dim = dim
+        self.append = append
+        suffix = "" if append else ".tmp"
+        self.vectors_path = f"{path}.f32{suffix}"
+        self.ids_path = f"{path}.ids{suffix}"
+        mode = "ab" if append else "wb"
+        self.vectors_file = open(self.vectors_path, mode)
+        self.ids_file = open(self.ids_path, mode)
+
+    def write(self, vectors, ids):
+        self.vectors_file.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+        self.ids_file.write(np.asarray(ids, dtype="int64").tobytes())
+
+    def close(self):
+        self.vectors_file.close()
+        self.ids_file.close()
+
+    def open(self):
+        # Returns (vectors, ids) memmaps over everything spooled so far
+        return _read_spool_files(self.vectors_path, self.ids_path, self.dim)
+
+    def commit(self):
+        # Swaps a fresh spool in over the live one (memmaps of it stay valid)
+        if self.append:
+            return
+        os.replace(self.vectors_path, f"{self.path}.f32")
+        os.replace(self.ids_path, f"{self.path}.ids")
+        self.vectors_path, self.ids_path = f"{self.path}.f32", f"{self.path}.ids"
+        self.append = True
+
+
+def read_spool(path, dim):
+    # Read-only view of a spool; constructing VectorSpool would replace it
+    return _read_spool_files(f"{path}.f32", f"{path}.ids", dim)
+
+
+def _read_spool_files(vectors_path, ids_path, dim):
+    n = os.path.getsize(ids_path) // 8
+    if n == 0:
+        return np.zeros((0, dim), dtype="float32"), np.zeros(0, dtype="int64")
+    vectors = np.memmap(vectors_path, dtype="float32", mode="r", shape=(n, dim))
+    ids = np.memmap(ids_path, dtype="int64", mode="r", shape=(n,))
+    return vectors, ids
+
+
+def prune_spool(path, dim, drop_ids, block_rows=SCAN_BLOCK_ROWS):
+    # Rewrites the spool without `drop_ids` (deleted chunks) and swaps it in
+    vectors, ids = read_spool(path, dim)
+    drop = np.asarray(drop_ids, dtype="int64")
+    pruned = VectorSpool(path, dim)
+    kept = 0
+    try:
+        for start in range(0, len(ids), block_rows):
+            block_ids = np.asarray(ids[start:start + block_rows])
+            keep = ~np.isin(block_ids, drop)
+            pruned.write(vectors[start:start + block_rows][keep], block_ids[keep])
+            kept += int(keep.sum())
+    finally:
+        pruned.close()
+    pruned.commit()
+    return len(ids) - kept
+
+
+class SpoolRescorer:
+    """Re-scores candidates from a quantized index with full-precision vectors.
+
+    Only the candidates' rows are read from the (memmapped) spool, so the
+    float32 matrix stays on disk while the compact index sits in RAM.
+    """
+
+    def __init__(self, vectors, ids):
+        self.vectors = vectors
+        self.order = np.argsort(ids, kind="stable")
+        self.sorted_ids = np.asarray(ids, dtype="int64")[self.order]
+
+    @classmethod
+    def from_spool(cls, path, dim):
+        return cls(*read_spool(path, dim))
+
+    def rescore(self, query_vec, candidate_ids, top_k):
+        # Returns (scores, ids) best first; candidates missing from the spool are dropped
+        candidates = np.asarray(candidate_ids, dtype="int64")
+        if not len(candidates) or not len(self.sorted_ids):
+            return [], []
+        slots = np.minimum(np.searchsorted(self.sorted_ids, candidates), len(self.sorted_ids) - 1)
+        found = self.sorted_ids[slots] == candidates
+        candidates, rows = candidates[found], self.order[slots[found]]
+        # Ascending rows keep the disk reads sequential
+        by_row = np.argsort(rows)
+        candidates, rows = candidates[by_row], rows[by_row]
+        scores = np.asarray(self.vectors[rows], dtype="float32") @ np.ravel(query_vec).astype("float32")
+        top = np.argsort(-scores)[:top_k]
+        return scores[top].tolist(), candidates[top].tolist()
+
+# ────────────────────────────────────────────────
+# EVALUATION
+# ────────────────────────────────────────────────
+def exact_neighbors(vectors, queries, k, batch_size=SCAN_BLOCK_ROWS):
+    # Brute-force ground truth, scanned in blocks so `vectors` may be a memmap
+    best_scores = np.full((len(queries), k), -np.inf, dtype="float32")
+    best_ids = np.full((len(queries), k), -1, dtype="int64")
+    for start in range(0, len(vectors), batch_size):
+        block = np.ascontiguousarray(vectors[start:start + batch_size], dtype="float32")
+        scores = queries @ block.T
+        ids = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+        all_scores = np.concatenate([best_scores, scores], axis=1)
+        all_ids = np.concatenate([best_ids, ids], axis=1)
+        top = np.argsort(-all_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(all_scores, top, axis=1)
+        best_ids = np.take_along_axis(all_ids, top, axis=1)
+    return best_ids
+
+
+def evaluate_index(index, vectors, ids=None, k=10, n_queries=200, seed=1, rescore_candidates=0):
+    """recall@k against exact search, plus single-query p50/p99 latency.
+
+    Queries are sampled from the corpus itself; `index` must hold exactly
+    `vectors`, stored under `ids` (or positions 0..n-1 when ids is None).
+    With `rescore_candidates`, that many hits are re-scored from `vectors`
+    and recall is reported before and after.
+    """
+    n = len(vectors)
+    rng = np.random.default_rng(seed)
+    picks = np.sort(rng.choice(n, size=min(n_queries, n), replace=False))
+    queries = np.ascontiguousarray(vectors[picks], dtype="float32")
+    k = min(k, n)
+    truth = exact_neighbors(vectors, queries, k)
+    if ids is not None:
+        truth = np.asarray(ids, dtype="int64")[truth]
+
+    rescorer = None
+    if rescore_candidates:
+        rescorer = SpoolRescorer(vectors, np.arange(n) if ids is None else ids)
+
+    latencies, hits, rescored_hits = [], 0, 0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, found = index.search(q.reshape(1, -1), max(k, rescore_candidates))
+        if rescorer is not None:
+            _, rescored = rescorer.rescore(q, found[0][found[0] != -1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(found[0][:k]) & set(expected))
+        if rescorer is not None:
+            rescored_hits += len(set(rescored) & set(expected))
+
+    report = {
+        "recall": hits / (len(queries) * k),
+        "k": k,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+    rescored_note = ""
+    if rescorer is not None:
+        report["rescored_recall"] = rescored_hits / (len(queries) * k)
+        rescored_note = f" → {report['rescored_recall']:.3f} rescored from {rescore_candidates}"
+    logging.info(
+        f"🎯 recall@{k}: {report['recall']:.3f}{rescored_note} | "
+        f"p50 {report['p50_ms']:.2f} ms | p99 {report['p99_ms']:.2f} ms"
+    )
+    return report
+
+# ────────────────────────────────────────────────
+# RESIDENT INDEX
+# ────────────────────────────────────────────────
+class ResidentIndex:
+    """Keeps a FAISS index loaded across queries.
+
+    The index file's mtime is checked at most every FAISS_RELOAD_CHECK_SECONDS;
+    when build_index.py writes a new version it is swapped in without a restart.
+    Indexes built before id mapping still work through their pickled id map.
+    When the index holds quantized codes and `spool_path` is given, each search
+    takes `rescore_candidates` hits and re-scores them in float32 from the spool.
+    """
+
+    def __init__(self, index_path, legacy_id_map_path=None, mmap=True,
+                 check_seconds=FAISS_RELOAD_CHECK_SECONDS, spool_path=None,
+                 rescore_candidates=FAISS_RESCORE_CANDIDATES):
+        self.index_path = index_path
+        self.legacy_id_map_path = legacy_id_map_path
+        self.mmap = mmap
+        self.check_seconds = check_seconds
+        self.spool_path = spool_path
+        self.rescore_candidates = rescore_candidates
+        self.lock = threading.Lock()
+        self.index = None
+        self.id_map = None
+        self.rescorer = None
+        self.version = None
+        self.checked_at = 0.0
+
+    def _load(self, version):
+        start = time.perf_counter()
+        index = read_index(self.index_path, self.mmap)
+        set_search_params(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+        id_map = None
+        if not is_id_mapped(index):
+            if not (self.legacy_id_map_path and os.path.exists(self.legacy_id_map_path)):
+                raise RuntimeError(f"{self.index_path} has no id mapping; rebuild it with build_index.py --rebuild")
+            logging.warning("⚠️ Using legacy id_map.pkl; rebuild the index to drop it")
+            with open(self.legacy_id_map_path, "rb") as f:
+                id_map = pickle.load(f)
+        rescorer = None
+        if self.spool_path and self.rescore_candidates and is_quantized(index):
+            if os.path.exists(f"{self.spool_path}.ids"):
+                rescorer = SpoolRescorer.from_spool(self.spool_path, index.d)
+            else:
+                logging.warning(f"⚠️ No vector spool at {self.spool_path}; quantized scores are not re-scored")
+        self.index, self.id_map, self.rescorer, self.version = index, id_map, rescorer, version
+        logging.info(f"📦 Loaded FAISS index ({index.ntotal} vectors) in {time.perf_counter() - start:.2f}s")
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.index is not None and now - self.checked_at < self.check_seconds:
+            return
+        with self.lock:
+            self.checked_at = now
+            version = os.stat(self.index_path).st_mtime_ns
+            if version != self.version:
+                self._load(version)
+
+    def search(self, query_vecs, top_k):
+        # Returns (scores, Postgres ids) for the first query, empty (-1) slots dropped
+        self.refresh()
+        index, id_map, rescorer = self.index, self.id_map, self.rescorer
+        fetch = max(top_k, self.rescore_candidates) if rescorer is not None else top_k
+        D, I = index.search(query_vecs, fetch)
+        hits = [(float(d), int(i)) for d, i in zip(D[0], I[0]) if i != -1]
+        if id_map is not None:
+            hits = [(d, id_map[i]) for d, i in hits]
+        if rescorer is not None:
+            return rescorer.rescore(query_vecs[0], [i for _, i in hits], top_k)
+        return [d for d, _ in hits], [i for _, i in hits]
@@ -3,18 +3,23 @@
 import os
 import pdfplumber
 import docx
-import numpy as np
-from sqlalchemy import create_engine, text
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
+from bulk_writer import BulkWriter
+from query_cache import bump_index_version
+from embed_batch import EmbeddingBatcher, embed_texts
+from embedding_cache import open_cache
+from resources import lazy_embedder, lazy_engine
 
 # CONFIGURATION
 PG_CONN_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
 if not PG_CONN_STRING:
     raise RuntimeError("POSTGRES_CONNECTION_STRING environment variable is not set.")
 
-engine = create_engine(PG_CONN_STRING)
-model = SentenceTransformer("intfloat/e5-base-v2")  # 768 dimensions
+# Engine and model load on first use (see resources.py)
+engine = lazy_engine(PG_CONN_STRING)
+MODEL_NAME = "intfloat/e5-base-v2"
+model = lazy_embedder(MODEL_NAME)  # 768 dimensions
+batcher = EmbeddingBatcher(model, workers=1, cache=open_cache(MODEL_NAME))
 
 def parse_file(file_path):
     ext = os.path.splitext(file_path)[1].lower().strip()
@@ -36,18 +41,14 @@ def embed_text(chunk):
     embedding = model.encode(chunk, normalize_embeddings=True)
     return embedding.tolist()
 
-def store_embedding(filename, chunk_id, chunk, embedding):
-    with engine.connect() as conn:
-        sql = text("""
-            INSERT INTO documents (filename, chunk_id, chunk_text, embedding)
-            VALUES (:filename, :chunk_id, :chunk_text, :embedding)
-        """)
-        conn.execute(sql, {
-            'filename': filename,
-            'chunk_id': chunk_id,
-            'chunk_text': chunk,
-            'embedding': embedding
-        })
+document_writer = BulkWriter(engine, "documents", ["filename", "chunk_id", "chunk_text", "embedding"])
+
+def store_embeddings(filename, chunks, embeddings):
+    document_writer.write(
+        (filename, i, chunk, embedding)
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+    )
+    bump_index_version()  # invalidates cached query results
 
 if __name__ == "__main__":
     while True:
@@ -57,9 +58,8 @@ if __name__ == "__main__":
         try:
             file_text = parse_file(file_path)
             chunks = chunk_text(file_text)
-            for i, chunk in enumerate(chunks):
-                embedding = embed_text(chunk)
-                store_embedding(os.path.basename(file_path), i, chunk, embedding)
+            embeddings = embed_texts(batcher, chunks)
+            store_embeddings(os.path.basename(file_path), chunks, embeddings)
             print(f"✅ Ingested {len(chunks)} chunks from {file_path}")
         except Exception as e:
             print(f"❌ Error processing {file_path}: {e}")
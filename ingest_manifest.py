@@ -0,0 +1,124 @@
+import os
+import json
+import uuid
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+INGEST_MANIFEST_PATH = os.getenv(
+    "INGEST_MANIFEST_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "ragtoriches", "ingest_manifest.sqlite"),
+)
+
+def file_content_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+# ────────────────────────────────────────────────
+# FILE STATE
+# ────────────────────────────────────────────────
+class FileState:
+    def __init__(self, path, size, mtime_ns, content_hash, doc_id, chunk_hashes):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.content_hash = content_hash
+        self.doc_id = doc_id
+        self.chunk_hashes = chunk_hashes  # hashes recorded at the previous ingest
+
+# ────────────────────────────────────────────────
+# MANIFEST
+# ────────────────────────────────────────────────
+class IngestManifest:
+    """Persistent record of ingested files, so unchanged files skip parsing.
+
+    Entries are namespaced per ingest script, since each one writes its own
+    embedding model's vectors.
+    """
+
+    def __init__(self, namespace, path=INGEST_MANIFEST_PATH):
+        self.namespace = namespace
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                namespace TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                chunk_hashes TEXT NOT NULL,
+                ingest_time TEXT NOT NULL,
+                PRIMARY KEY (namespace, path)
+            )
+        """)
+        self.db.commit()
+
+    def _entry(self, path):
+        row = self.db.execute(
+            "SELECT size, mtime_ns, content_hash, doc_id, chunk_hashes FROM files "
+            "WHERE namespace = ? AND path = ?",
+            (self.namespace, path),
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, content_hash, doc_id, chunk_hashes = row
+        return FileState(path, size, mtime_ns, content_hash, doc_id, json.loads(chunk_hashes))
+
+    def changed_files(self, paths):
+        # Returns {path: FileState} for new or modified files. The state
+        # carries the doc_id to reuse and the previously stored chunk hashes.
+        changed = {}
+        skipped = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            entry = self._entry(path)
+            if entry and entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+                skipped += 1
+                continue
+
+            content_hash = file_content_hash(path)
+            if entry and entry.content_hash == content_hash:
+                # Touched but not modified: refresh the stat key only
+                self.db.execute(
+                    "UPDATE files SET size = ?, mtime_ns = ? WHERE namespace = ? AND path = ?",
+                    (st.st_size, st.st_mtime_ns, self.namespace, path),
+                )
+                skipped += 1
+                continue
+
+            doc_id = entry.doc_id if entry else str(uuid.uuid5(uuid.NAMESPACE_URL, path))
+            previous = entry.chunk_hashes if entry else []
+            changed[path] = FileState(path, st.st_size, st.st_mtime_ns, content_hash, doc_id, previous)
+        self.db.commit()
+        logging.info(f"🗂️ Manifest: {len(changed)} new/changed files, {skipped} unchanged skipped")
+        return changed
+
+    def record(self, state, chunk_hashes):
+        self.db.execute("""
+            INSERT INTO files (namespace, path, size, mtime_ns, content_hash, doc_id, chunk_hashes, ingest_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (namespace, path) DO UPDATE SET
+                size = excluded.size,
+                mtime_ns = excluded.mtime_ns,
+                content_hash = excluded.content_hash,
+                doc_id = excluded.doc_id,
+                chunk_hashes = excluded.chunk_hashes,
+                ingest_time = excluded.ingest_time
+        """, (
+            self.namespace, state.path, state.size, state.mtime_ns, state.content_hash,
+            state.doc_id, json.dumps(chunk_hashes), datetime.utcnow().isoformat(),
+        ))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,216 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Max items waiting between two stages; a full queue blocks the stage upstream
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+
+_DONE = object()
+
+# ────────────────────────────────────────────────
+# STAGE STATS
+# ────────────────────────────────────────────────
+class StageStats:
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0
+
+    def record(self, seconds, items=1):
+        self.busy += seconds
+        self.items += items
+
+    def utilization(self, wall):
+        return self.busy / (wall * self.workers) if wall else 0.0
+
+
+def log_stage_report(stats, wall):
+    logging.info(f"📊 Ingest pipeline finished in {wall:.1f}s")
+    for s in stats:
+        logging.info(
+            f"   {s.name:<6} {s.utilization(wall):6.1%} busy | "
+            f"{s.items} items | {s.errors} errors | {s.workers} worker(s)"
+        )
+    bottleneck = max(stats, key=lambda s: s.utilization(wall))
+    logging.info(f"🐢 Bottleneck stage: {bottleneck.name}")
+
+# ────────────────────────────────────────────────
+# STAGES
+# ────────────────────────────────────────────────
+class _Inbox:
+    # A stage's input queue; remembers whether the end marker was seen so a
+    # failed stage can keep draining without blocking forever
+    def __init__(self, q):
+        self.q = q
+        self.done = False
+
+    def __iter__(self):
+        while (item := self.q.get()) is not _DONE:
+            yield item
+        self.done = True
+
+    def drain(self):
+        if not self.done:
+            for _ in self:
+                pass
+
+
+def _run_stage(name, body, inbox, out_q, failures):
+    # A stage that dies keeps consuming its input, so upstream put() calls
+    # never block, and always signals the end downstream. run_pipeline
+    # re-raises the first failure once every stage has stopped.
+    try:
+        body()
+    except BaseException as e:
+        failures.append(e)
+        logging.error(f"❌ Ingest {name} stage stopped: {e!r}")
+        if inbox is not None:
+            inbox.drain()
+    finally:
+        if out_q is not None:
+            out_q.put(_DONE)
+
+
+def _timed_parse(parse_fn, path):
+    # Runs in a worker process; errors are returned rather than raised so one
+    # bad file doesn't cancel the pool.
+    start = time.perf_counter()
+    try:
+        return path, parse_fn(path), None, time.perf_counter() - start
+    except Exception as e:
+        return path, None, e, time.perf_counter() - start
+
+
+def _parse_stage(paths, parse_fn, out_q, stats, workers):
+    in_flight = {}  # future → path
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path in paths:
+            # Cap submitted work so parsed text can't pile up ahead of chunking
+            while len(in_flight) >= workers * 2:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                _emit_parsed(finished, in_flight, out_q, stats)
+            in_flight[pool.submit(_timed_parse, parse_fn, path)] = path
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            _emit_parsed(finished, in_flight, out_q, stats)
+
+
+def _emit_parsed(futures, in_flight, out_q, stats):
+    for future in futures:
+        path = in_flight.pop(future)
+        try:
+            _, raw_text, error, seconds = future.result()
+        except BrokenProcessPool:
+            raise  # every remaining file would fail the same way; stop the run
+        except Exception as e:
+            # e.g. a result that couldn't be sent back from the worker
+            raw_text, error, seconds = None, e, 0.0
+        stats.record(seconds)
+        if error is not None:
+            stats.errors += 1
+            logging.error(f"❌ Failed to parse {os.path.basename(path)}: {error}")
+            continue
+        out_q.put((path, raw_text))
+
+
+def _chunk_stage(chunk_fn, inbox, out_q, stats):
+    for path, raw_text in inbox:
+        start = time.perf_counter()
+        try:
+            out_q.put(chunk_fn(path, raw_text))
+        except Exception as e:
+            stats.errors += 1
+            logging.error(f"❌ Failed to chunk {os.path.basename(path)}: {e}")
+        stats.record(time.perf_counter() - start)
+
+
+def _embed_stage(batcher, inbox, out_q, stats, on_error):
+    def run(step, n):
+        start = time.perf_counter()
+        try:
+            embedded = step()
+        except Exception as e:
+            stats.errors += 1
+            logging.error(f"❌ Embedding batch failed: {e}")
+            # EmbeddingBatchError carries the batch's payloads
+            on_error(getattr(e, "payloads", []), e)
+            embedded = []
+        stats.record(time.perf_counter() - start, n)
+        if embedded:
+            out_q.put(embedded)
+
+    for items in inbox:
+        for text, payload in items:
+            run(lambda: batcher.add(text, payload), 1)
+    run(batcher.flush, 0)
+
+
+def _write_stage(write_fn, inbox, stats, totals, on_error):
+    for embedded in inbox:
+        start = time.perf_counter()
+        try:
+            totals["stored"] += write_fn(embedded)
+        except Exception as e:
+            stats.errors += 1
+            logging.error(f"❌ Failed to write {len(embedded)} chunks: {e}")
+            on_error([payload for payload, _ in embedded], e)
+        stats.record(time.perf_counter() - start, len(embedded))
+
+# ────────────────────────────────────────────────
+# PIPELINE
+# ────────────────────────────────────────────────
+def run_pipeline(paths, parse_fn, chunk_fn, batcher, write_fn, on_error=None,
+                 parse_workers=INGEST_PARSE_WORKERS, queue_size=INGEST_QUEUE_SIZE):
+    """parse (process pool) → chunk → embed (batched) → write, joined by bounded queues.
+
+    `parse_fn(path)` must be picklable and return the raw text.
+    `chunk_fn(path, raw_text)` returns a list of (chunk_text, payload) pairs.
+    `write_fn(embedded)` stores a list of (payload, embedding) and returns the row count.
+    `on_error(payloads, error)` is called with the payloads of every batch that
+    failed to embed or write, so callers can tell which chunks never landed.
+    If a stage itself fails (e.g. the parse pool breaks or on_error raises),
+    the others drain and stop, and that first error is raised here.
+    """
+    on_error = on_error or (lambda payloads, error: None)
+    parsed_q = queue.Queue(maxsize=queue_size)
+    chunked_q = queue.Queue(maxsize=queue_size)
+    embedded_q = queue.Queue(maxsize=queue_size)
+
+    parse_stats = StageStats("parse", parse_workers)
+    chunk_stats = StageStats("chunk")
+    embed_stats = StageStats("embed")
+    write_stats = StageStats("write")
+    totals = {"stored": 0}
+
+    failures = []
+    parsed_in, chunked_in, embedded_in = _Inbox(parsed_q), _Inbox(chunked_q), _Inbox(embedded_q)
+    stages = [
+        ("parse", lambda: _parse_stage(paths, parse_fn, parsed_q, parse_stats, parse_workers), None, parsed_q),
+        ("chunk", lambda: _chunk_stage(chunk_fn, parsed_in, chunked_q, chunk_stats), parsed_in, chunked_q),
+        ("embed", lambda: _embed_stage(batcher, chunked_in, embedded_q, embed_stats, on_error), chunked_in, embedded_q),
+        ("write", lambda: _write_stage(write_fn, embedded_in, write_stats, totals, on_error), embedded_in, None),
+    ]
+    threads = [
+        threading.Thread(target=_run_stage, args=(name, body, inbox, out_q, failures))
+        for name, body, inbox, out_q in stages
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    log_stage_report([parse_stats, chunk_stats, embed_stats, write_stats], time.perf_counter() - start)
+    if failures:
+        raise failures[0]
+    return totals["stored"]
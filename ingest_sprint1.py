@@ -1,16 +1,20 @@
 import os
 import re
-import uuid
 import hashlib
 import logging
 import pdfplumber
 import docx
-import numpy as np
-import tiktoken
 from datetime import datetime
-from sqlalchemy import create_engine, text
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
+from sqlalchemy import text
+from embed_batch import EmbeddingBatcher
+from embedding_cache import open_cache
+from dedupe import ChunkHashIndex
+from bulk_writer import BulkWriter
+from ingest_pipeline import run_pipeline
+from ingest_manifest import IngestManifest
+from query_cache import bump_index_version
+import chunker
+from resources import Lazy, lazy_embedder, lazy_engine
 
 # ────────────────────────────────────────────────
 # CONFIGURATION & SETUP
@@ -18,13 +22,15 @@ from sentence_transformers import SentenceTransformer
 PG_CONN_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
 if not PG_CONN_STRING:
     raise RuntimeError("❌ POSTGRES_CONNECTION_STRING is not set.")
-engine = create_engine(PG_CONN_STRING)
+engine = lazy_engine(PG_CONN_STRING)
 
 # TODO: change to larger model when RAM allows
 # For production, consider using a larger model like "all-MiniLM-L12-v2" for better accuracy
 # but it requires more RAM and processing time.
-model = SentenceTransformer("all-MiniLM-L6-v2")  # 384-dim, very small and fast, 1048-dim model needs more RAM
-tokenizer = tiktoken.get_encoding("cl100k_base")
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Loaded on first embed, so --help and env checks don't pay for it (see resources.py)
+model = lazy_embedder(MODEL_NAME)  # 384-dim, very small and fast, 1048-dim model needs more RAM
+tokenizer = Lazy("cl100k_base tokenizer", chunker.get_encoding)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 
@@ -42,9 +48,6 @@ def extract_doc_title(text):
 def compute_hash(text):
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-def count_tokens(text):
-    return len(tokenizer.encode(text))
-
 # ────────────────────────────────────────────────
 # FILE PARSING
 # ────────────────────────────────────────────────
@@ -63,8 +66,9 @@ def parse_file(file_path):
 # CHUNKING AND EMBEDDING
 # ────────────────────────────────────────────────
 def chunk_text(text):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=700, chunk_overlap=100)
-    return [chunk.strip() for chunk in splitter.split_text(text) if count_tokens(chunk) >= 10]
+    # (chunk, token_count) pairs from one tokenization of the whole document;
+    # CHUNK_TOKENS / CHUNK_OVERLAP_TOKENS / CHUNK_MIN_TOKENS tune the windows
+    return chunker.chunk_text(text, tokenizer)
 
 def embed_text(chunk):
     return model.encode(chunk, normalize_embeddings=True).tolist()
@@ -72,70 +76,147 @@ def embed_text(chunk):
 # ────────────────────────────────────────────────
 # DB OPERATIONS
 # ────────────────────────────────────────────────
-def is_duplicate(chunk_hash):
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT 1 FROM documents WHERE chunk_hash = :h LIMIT 1"), {"h": chunk_hash})
-        return result.scalar() is not None
-
-def store_chunk(doc_id, title, filename, chunk_id, chunk, embedding, chunk_hash, token_count):
-    with engine.begin() as conn:  # Use begin() for transaction (autocommit)
-        conn.execute(text("""
-            INSERT INTO documents (
-                doc_id, doc_title, filename, chunk_id,
-                chunk_text, embedding, chunk_hash,
-                token_count, ingest_time
-            ) VALUES (
-                :doc_id, :doc_title, :filename, :chunk_id,
-                :chunk_text, :embedding, :chunk_hash,
-                :token_count, :ingest_time
-            )
-        """), {
-            "doc_id": doc_id,
-            "doc_title": title,
-            "filename": filename,
-            "chunk_id": chunk_id,
-            "chunk_text": chunk,
-            "embedding": embedding,
-            "chunk_hash": chunk_hash,
-            "token_count": token_count,
-            "ingest_time": datetime.utcnow()
-        })
+DOCUMENT_COLUMNS = [
+    "doc_id", "doc_title", "filename", "chunk_id",
+    "chunk_text", "embedding", "chunk_hash",
+    "token_count", "ingest_time",
+]
+document_writer = BulkWriter(engine, "documents", DOCUMENT_COLUMNS)
+
+def store_chunks(embedded):
+    # One COPY + commit per embedded batch
+    ingest_time = datetime.utcnow()
+    document_writer.write(
+        (row["doc_id"], row["title"], row["filename"], row["chunk_id"],
+         row["chunk"], embedding, row["chunk_hash"],
+         row["token_count"], ingest_time)
+        for row, embedding in embedded
+    )
+    # Query processes drop retrieval results cached before this write
+    bump_index_version()
+    return len(embedded)
+
+def remove_chunks(doc_id, chunk_hashes):
+    # Drops chunks that disappeared from a changed file
+    with engine.begin() as conn:
+        conn.execute(
+            text("DELETE FROM documents WHERE doc_id = :doc_id AND chunk_hash = ANY(:hashes)"),
+            {"doc_id": doc_id, "hashes": list(chunk_hashes)},
+        )
+    bump_index_version()
+
+def renumber_chunks(doc_id, chunk_hashes):
+    # Unchanged chunks of an edited file still carry their old chunk_id; move
+    # every row to its position in the new version so neighbours stay contiguous
+    positions = {}
+    for i, chunk_hash in enumerate(chunk_hashes):
+        positions.setdefault(chunk_hash, i)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "UPDATE documents AS d SET chunk_id = v.position "
+                "FROM unnest(CAST(:hashes AS text[]), CAST(:positions AS int[])) AS v(chunk_hash, position) "
+                "WHERE d.doc_id = :doc_id AND d.chunk_hash = v.chunk_hash AND d.chunk_id <> v.position"
+            ),
+            {"doc_id": doc_id, "hashes": list(positions), "positions": list(positions.values())},
+        )
+    bump_index_version()
 
 # ────────────────────────────────────────────────
 # INGEST FOLDER
 # ────────────────────────────────────────────────
-def ingest_folder(folder_path):
-    for file_name in os.listdir(folder_path):
-        if not file_name.endswith((".pdf", ".docx")):
+def prepare_chunks(hash_index, state, raw_text, file_hashes, unwritten):
+    # file_hashes / unwritten are only filled once the file's chunks are settled,
+    # so a file that fails here is never recorded as done
+    file_name = os.path.basename(state.path)
+    if not raw_text.strip():
+        logging.warning(f"⚠️ No extractable text in {file_name}")
+        unwritten[state.doc_id] = 0
+        file_hashes[state.path] = []
+        return []
+
+    safe_name = sanitize_filename(file_name)
+    title = extract_doc_title(raw_text)
+    chunks = chunk_text(raw_text)
+
+    hashes = [compute_hash(chunk) for chunk, _ in chunks]
+    new_hashes = set(hash_index.filter_new(hashes))
+    hash_index.add(new_hashes)
+
+    prepared = []
+    for i, ((chunk, token_count), chunk_hash) in enumerate(zip(chunks, hashes)):
+        if chunk_hash not in new_hashes:
             continue
+        new_hashes.discard(chunk_hash)
+        prepared.append((chunk, {
+            "doc_id": state.doc_id, "title": title, "filename": safe_name,
+            "chunk_id": i, "chunk": chunk, "chunk_hash": chunk_hash,
+            "token_count": token_count,
+        }))
 
-        file_path = os.path.join(folder_path, file_name)
-        logging.info(f"📄 Processing: {file_name}")
-
-        try:
-            raw_text = parse_file(file_path)
-            if not raw_text.strip():
-                logging.warning(f"⚠️ No extractable text in {file_name}")
-                continue
-
-            doc_id = str(uuid.uuid4())
-            safe_name = sanitize_filename(file_name)
-            title = extract_doc_title(raw_text)
-            chunks = chunk_text(raw_text)
-
-            new_chunks = 0
-            for i, chunk in enumerate(chunks):
-                chunk_hash = compute_hash(chunk)
-                if is_duplicate(chunk_hash):
-                    continue
-                embedding = embed_text(chunk)
-                store_chunk(doc_id, title, safe_name, i, chunk, embedding, chunk_hash, count_tokens(chunk))
-                new_chunks += 1
-
-            logging.info(f"✅ Stored {new_chunks} new chunks from {file_name}")
-
-        except Exception as e:
-            logging.error(f"❌ Failed to process {file_name}: {e}")
+    # Set before the chunks are handed on, so the writer can only count down
+    unwritten[state.doc_id] = len(prepared)
+    file_hashes[state.path] = hashes
+    logging.info(f"📄 {file_name}: {len(prepared)} new of {len(chunks)} chunks")
+    return prepared
+
+def ingest_folder(folder_path):
+    paths = [
+        os.path.join(folder_path, file_name)
+        for file_name in sorted(os.listdir(folder_path))
+        if file_name.endswith((".pdf", ".docx"))
+    ]
+    manifest = IngestManifest("ingest_sprint1")
+    changed = manifest.changed_files(paths)
+    if not changed:
+        manifest.close()
+        logging.info(f"✅ Nothing to ingest in {folder_path}")
+        return
+
+    hash_index = ChunkHashIndex(engine).warm()
+    batcher = EmbeddingBatcher(model, cache=open_cache(MODEL_NAME))
+    file_hashes = {}
+    unwritten = {}  # doc_id → prepared chunks not yet stored
+    failed_docs = set()
+
+    def write(embedded):
+        stored = store_chunks(embedded)
+        for row, _ in embedded:
+            unwritten[row["doc_id"]] -= 1
+        return stored
+
+    def failed(payloads, error):
+        # Batches that failed to embed or write; their files retry next run
+        failed_docs.update(row["doc_id"] for row in payloads)
+
+    try:
+        stored = run_pipeline(
+            list(changed),
+            parse_file,
+            lambda path, raw_text: prepare_chunks(hash_index, changed[path], raw_text, file_hashes, unwritten),
+            batcher,
+            write,
+            on_error=failed,
+        )
+    finally:
+        batcher.close()
+
+    # Only files whose chunks all landed are recorded; the rest retry next run
+    for path, hashes in file_hashes.items():
+        state = changed[path]
+        if state.doc_id in failed_docs or unwritten.get(state.doc_id):
+            continue
+        gone = set(state.chunk_hashes) - set(hashes)
+        if gone:
+            remove_chunks(state.doc_id, gone)
+            hash_index.discard(gone)
+        if state.chunk_hashes:
+            renumber_chunks(state.doc_id, hashes)
+        manifest.record(state, hashes)
+    manifest.close()
+
+    batcher.meter.log()
+    logging.info(f"✅ Stored {stored} new chunks from {folder_path}")
 
 # ────────────────────────────────────────────────
 # MAIN EXECUTION
@@ -0,0 +1,97 @@
+import time
+import logging
+
+# ────────────────────────────────────────────────
+# HELPERS
+# ────────────────────────────────────────────────
+def _delta_text(chunk):
+    # Works for openai>=1 chunk objects and the legacy 0.x OpenAIObject dicts;
+    # the final usage-only chunk has no choices
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return ""
+    return getattr(choices[0].delta, "content", None) or ""
+
+
+def _usage(chunk):
+    return getattr(chunk, "usage", None)
+
+# ────────────────────────────────────────────────
+# STREAMED ANSWER
+# ────────────────────────────────────────────────
+class StreamedAnswer:
+    """Iterates a `stream=True` chat completion, yielding text as it arrives.
+
+    Time to first token and total latency are measured from `started_at`
+    (take it just before the create() call). Once iteration ends, `text`
+    holds the whole answer and `on_complete(self)` runs, e.g. to cache it.
+    """
+
+    def __init__(self, stream, started_at=None, on_complete=None):
+        self.stream = stream
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.on_complete = on_complete
+        self.pieces = []
+        self.usage = None
+        self.ttft = None
+        self.total = None
+
+    @classmethod
+    def from_text(cls, text):
+        # Already-known answer (e.g. a cache hit) behind the same interface
+        answer = cls(None)
+        answer.pieces = [text]
+        answer.ttft = answer.total = 0.0
+        return answer
+
+    def _consume(self, chunk):
+        usage = _usage(chunk)
+        if usage is not None:
+            self.usage = usage
+        piece = _delta_text(chunk)
+        if piece:
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self.started_at
+            self.pieces.append(piece)
+        return piece
+
+    def _finish(self):
+        self.total = time.perf_counter() - self.started_at
+        logging.info(f"⏱️ First token {self.ttft or 0:.2f}s | full answer {self.total:.2f}s")
+        if self.on_complete is not None:
+            self.on_complete(self)
+
+    def __iter__(self):
+        if self.stream is None:
+            yield from self.pieces
+            return
+        for chunk in self.stream:
+            piece = self._consume(chunk)
+            if piece:
+                yield piece
+        self._finish()
+
+    @property
+    def text(self):
+        return "".join(self.pieces)
+
+    def completion_tokens(self, encoding):
+        # Server-reported usage when the stream included it, else count locally
+        if self.usage is not None and getattr(self.usage, "completion_tokens", None) is not None:
+            return self.usage.completion_tokens
+        return len(encoding.encode(self.text))
+
+
+class AsyncStreamedAnswer(StreamedAnswer):
+    """StreamedAnswer over an AsyncOpenAI / AsyncAzureOpenAI stream."""
+
+    async def __aiter__(self):
+        if self.stream is None:
+            for piece in self.pieces:
+                yield piece
+            return
+        async for chunk in self.stream:
+            piece = self._consume(chunk)
+            if piece:
+                yield piece
+        self._finish()
@@ -0,0 +1,320 @@
+import os
+import math
+import time
+import logging
+import argparse
+import importlib
+from contextlib import contextmanager
+import numpy as np
+from sqlalchemy import create_engine, text
+import pgvector_search
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+# Same metric names as search_similar_chunks / pgvector_search
+OPERATOR_CLASSES = {
+    "cosine": "vector_cosine_ops",
+    "l2": "vector_l2_ops",
+    "inner": "vector_ip_ops",
+}
+METHODS = ("hnsw", "ivfflat")
+# Operator classes for the compact expression indexes (see pgvector_search.quantized_sql)
+QUANTIZED_OPERATOR_CLASSES = {
+    "halfvec": {"cosine": "halfvec_cosine_ops", "l2": "halfvec_l2_ops", "inner": "halfvec_ip_ops"},
+    "bit": {"cosine": "bit_hamming_ops", "l2": "bit_hamming_ops", "inner": "bit_hamming_ops"},
+}
+# Bytes per dimension of each stored code, for the memory report
+CODE_BYTES_PER_DIM = {None: 4.0, "halfvec": 2.0, "bit": 1 / 8}
+
+BUILD_MAINTENANCE_WORK_MEM = os.getenv("PGVECTOR_BUILD_MEMORY", "2GB")
+BUILD_PARALLEL_WORKERS = int(os.getenv("PGVECTOR_BUILD_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+
+def get_engine():
+    conn_string = os.getenv("POSTGRES_CONNECTION_STRING")
+    if not conn_string:
+        raise RuntimeError("❌ POSTGRES_CONNECTION_STRING is not set.")
+    return create_engine(conn_string)
+
+# ────────────────────────────────────────────────
+# HELPERS
+# ────────────────────────────────────────────────
+def index_name(table, method, metric, column="embedding", quantization=None):
+    if quantization:
+        return f"{table}_{column}_{quantization}_{method}_{metric}_idx"
+    return f"{table}_{column}_{method}_{metric}_idx"
+
+
+def vector_dims(engine, table="documents", column="embedding"):
+    with engine.connect() as conn:
+        dim = conn.execute(text(f"SELECT vector_dims({column}) FROM {table} LIMIT 1")).scalar()
+    if dim is None:
+        raise RuntimeError(f"❌ {table} has no rows to take the {column} dimension from.")
+    return dim
+
+
+def index_size(engine, name):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT pg_relation_size(to_regclass(:name))"), {"name": name}).scalar() or 0
+
+
+def default_lists(row_count):
+    # pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+
+def _build_settings(conn, maintenance_work_mem, parallel_workers):
+    # Plain SET lasts for this session only; index builds are much faster
+    # when the graph/lists fit in maintenance_work_mem
+    conn.execute(text(f"SET maintenance_work_mem = '{maintenance_work_mem}'"))
+    conn.execute(text(f"SET max_parallel_maintenance_workers = {int(parallel_workers)}"))
+
+
+@contextmanager
+def _autocommit(engine):
+    # CREATE/REINDEX ... CONCURRENTLY can't run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        yield conn
+
+
+def list_indexes(engine, table="documents", column="embedding"):
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename = :table
+              AND (indexdef LIKE '%USING hnsw%' OR indexdef LIKE '%USING ivfflat%')
+              AND (indexdef LIKE :column OR indexdef LIKE :expression)
+        """), {"table": table, "column": f"%({column} %", "expression": f"%({column})%"}).fetchall()
+    return [(r[0], r[1]) for r in rows]
+
+# ────────────────────────────────────────────────
+# INDEX LIFECYCLE
+# ────────────────────────────────────────────────
+def create_index(engine, table="documents", method="hnsw", metric="cosine", column="embedding",
+                 m=16, ef_construction=64, lists=None, concurrently=False, quantization=None,
+                 maintenance_work_mem=BUILD_MAINTENANCE_WORK_MEM, parallel_workers=BUILD_PARALLEL_WORKERS):
+    if method not in METHODS:
+        raise ValueError(f"Unknown index method: {method}")
+    name = index_name(table, method, metric, column, quantization)
+    if quantization:
+        # Expression index over halfvec / binary codes; the float32 column stays for rescoring
+        opclass = QUANTIZED_OPERATOR_CLASSES[quantization][metric]
+        expression = pgvector_search.quantized_expression(quantization, vector_dims(engine, table, column), column)
+        key = f"({expression}) {opclass}"
+    else:
+        key = f"{column} {OPERATOR_CLASSES[metric]}"
+
+    with _autocommit(engine) as conn:
+        if method == "hnsw":
+            options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+        else:
+            # IVFFlat clusters the rows present at build time, so size lists from them
+            if lists is None:
+                rows = conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+                lists = default_lists(rows)
+            options = f"lists = {int(lists)}"
+
+        _build_settings(conn, maintenance_work_mem, parallel_workers)
+        start = time.perf_counter()
+        conn.execute(text(
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+            f"ON {table} USING {method} ({key}) WITH ({options})"
+        ))
+    logging.info(f"✅ Built {name} ({options}) in {time.perf_counter() - start:.1f}s")
+    return name
+
+
+def drop_index(engine, name, concurrently=False):
+    with _autocommit(engine) as conn:
+        conn.execute(text(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {name}"))
+    logging.info(f"🗑️ Dropped {name}")
+
+
+def rebuild_index(engine, name, concurrently=True,
+                  maintenance_work_mem=BUILD_MAINTENANCE_WORK_MEM, parallel_workers=BUILD_PARALLEL_WORKERS):
+    with _autocommit(engine) as conn:
+        _build_settings(conn, maintenance_work_mem, parallel_workers)
+        start = time.perf_counter()
+        conn.execute(text(f"REINDEX INDEX {'CONCURRENTLY ' if concurrently else ''}{name}"))
+    logging.info(f"🔁 Rebuilt {name} in {time.perf_counter() - start:.1f}s")
+
+
+def ensure_fts(engine, table="documents", config=None, concurrently=False):
+    # Stored tsvector kept in sync by Postgres itself, so ingest code and
+    # COPY column lists don't change
+    config = config or os.getenv("FTS_CONFIG", "english")
+    with _autocommit(engine) as conn:
+        conn.execute(text(f"""
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS chunk_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('{config}', coalesce(chunk_text, ''))) STORED
+        """))
+        start = time.perf_counter()
+        conn.execute(text(
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {table}_chunk_tsv_idx "
+            f"ON {table} USING gin (chunk_tsv)"
+        ))
+    logging.info(f"✅ {table}.chunk_tsv ({config}) GIN index ready in {time.perf_counter() - start:.1f}s")
+
+
+def evaluate_quantized(engine, table="documents", metric="cosine", quantization="halfvec",
+                       column="embedding", k=10, n_queries=100, candidates=pgvector_search.RESCORE_CANDIDATES):
+    """recall@k of the quantized index, with and without rescoring, plus its size.
+
+    Queries are embeddings sampled from the table; ground truth is an exact
+    scan with index scans disabled. Recall "first pass" keeps only k
+    candidates, so it is what the compact codes find on their own.
+    """
+    operator = pgvector_search.METRIC_OPERATORS[metric]
+    with engine.connect() as conn:
+        samples = conn.execute(text(
+            f"SELECT {column}::text FROM {table} ORDER BY random() LIMIT :n"
+        ), {"n": int(n_queries)}).scalars().all()
+    queries = [np.array(s.strip("[]").split(","), dtype="float32") for s in samples]
+
+    first_hits = rescored_hits = 0
+    latencies = []
+    for query in queries:
+        with engine.begin() as conn:
+            conn.execute(text("SET LOCAL enable_indexscan = off"))
+            truth = set(conn.execute(text(
+                f"SELECT ctid::text FROM {table} ORDER BY {column} {operator} CAST(:q AS vector) LIMIT :k"
+            ), {"q": pgvector_search.vector_literal(query), "k": k}).scalars())
+        first = pgvector_search.search(engine, query, k, metric, ("ctid::text AS row_id",), table,
+                                       quantization=quantization, rescore_candidates=k)
+        start = time.perf_counter()
+        rescored = pgvector_search.search(engine, query, k, metric, ("ctid::text AS row_id",), table,
+                                          quantization=quantization, rescore_candidates=candidates)
+        latencies.append((time.perf_counter() - start) * 1000)
+        first_hits += len(truth & {r[0] for r in first})
+        rescored_hits += len(truth & {r[0] for r in rescored})
+
+    dim = len(queries[0]) if queries else 0
+    total = max(1, len(queries) * k)
+    report = {
+        "recall_first_pass": first_hits / total,
+        "recall_rescored": rescored_hits / total,
+        "candidates": candidates,
+        "p50_ms": float(np.median(latencies)) if latencies else 0.0,
+        "index_bytes": index_size(engine, index_name(table, "hnsw", metric, column, quantization))
+                       or index_size(engine, index_name(table, "ivfflat", metric, column, quantization)),
+        "code_bytes": dim * CODE_BYTES_PER_DIM[quantization],
+        "full_bytes": dim * CODE_BYTES_PER_DIM[None],
+    }
+    logging.info(
+        f"🎯 {quantization} recall@{k}: {report['recall_first_pass']:.3f} first pass → "
+        f"{report['recall_rescored']:.3f} rescored from {candidates} | p50 {report['p50_ms']:.1f} ms"
+    )
+    logging.info(
+        f"💾 {report['code_bytes']:.0f} B/vector vs {report['full_bytes']:.0f} B float32 "
+        f"({1 - report['code_bytes'] / max(report['full_bytes'], 1):.0%} smaller); "
+        f"index {report['index_bytes'] / 2**20:.1f} MiB"
+    )
+    return report
+
+
+@contextmanager
+def bulk_load(engine, table="documents", column="embedding",
+              maintenance_work_mem=BUILD_MAINTENANCE_WORK_MEM, parallel_workers=BUILD_PARALLEL_WORKERS):
+    """Drops the table's vector indexes for a large load and rebuilds them after.
+
+    Inserting into a live HNSW graph row by row is far slower than building it
+    once over the loaded data.
+    """
+    saved = list_indexes(engine, table, column)
+    for name, _ in saved:
+        drop_index(engine, name)
+    try:
+        yield
+    finally:
+        for name, definition in saved:
+            with _autocommit(engine) as conn:
+                _build_settings(conn, maintenance_work_mem, parallel_workers)
+                start = time.perf_counter()
+                conn.execute(text(definition))
+            logging.info(f"✅ Rebuilt {name} after bulk load in {time.perf_counter() - start:.1f}s")
+
+# ────────────────────────────────────────────────
+# CLI
+# ────────────────────────────────────────────────
+def parse_args():
+    parser = argparse.ArgumentParser(description="Manage pgvector ANN indexes on documents.embedding.")
+    parser.add_argument("--table", default="documents")
+    parser.add_argument("--memory", default=BUILD_MAINTENANCE_WORK_MEM, help="maintenance_work_mem for builds")
+    parser.add_argument("--workers", type=int, default=BUILD_PARALLEL_WORKERS,
+                        help="max_parallel_maintenance_workers for builds")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    create = sub.add_parser("create", help="create an HNSW or IVFFlat index")
+    create.add_argument("--method", choices=METHODS, default="hnsw")
+    create.add_argument("--metric", choices=OPERATOR_CLASSES, default="cosine")
+    create.add_argument("--m", type=int, default=16)
+    create.add_argument("--ef-construction", type=int, default=64)
+    create.add_argument("--lists", type=int, default=None, help="IVFFlat lists (default from row count)")
+    create.add_argument("--concurrently", action="store_true")
+
+    quantize = sub.add_parser("quantize", help="create a halfvec/bit index, then report recall and size")
+    quantize.add_argument("--quantization", choices=pgvector_search.QUANTIZATIONS, default="halfvec")
+    quantize.add_argument("--method", choices=METHODS, default="hnsw")
+    quantize.add_argument("--metric", choices=OPERATOR_CLASSES, default="cosine")
+    quantize.add_argument("--m", type=int, default=16)
+    quantize.add_argument("--ef-construction", type=int, default=64)
+    quantize.add_argument("--lists", type=int, default=None, help="IVFFlat lists (default from row count)")
+    quantize.add_argument("--concurrently", action="store_true")
+    quantize.add_argument("--candidates", type=int, default=pgvector_search.RESCORE_CANDIDATES,
+                          help="rows re-scored in float32")
+    quantize.add_argument("--eval-k", type=int, default=10, help="k for the recall@k report")
+    quantize.add_argument("--eval-queries", type=int, default=100, help="0 disables the report")
+
+    drop = sub.add_parser("drop", help="drop an index by name")
+    drop.add_argument("name")
+
+    rebuild = sub.add_parser("rebuild", help="REINDEX one index, or all vector indexes")
+    rebuild.add_argument("name", nargs="?")
+
+    sub.add_parser("list", help="list vector indexes")
+
+    fts = sub.add_parser("fts", help="add the chunk_tsv column + GIN index used by hybrid search")
+    fts.add_argument("--config", default=None, help="text search config (default FTS_CONFIG or english)")
+
+    load = sub.add_parser("bulk-load", help="drop indexes, ingest a folder, rebuild indexes")
+    load.add_argument("folder")
+    load.add_argument("--ingest", default="ingest_improved", help="module providing ingest_folder()")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    engine = get_engine()
+    build = {"maintenance_work_mem": args.memory, "parallel_workers": args.workers}
+
+    if args.command == "create":
+        create_index(engine, args.table, args.method, args.metric, m=args.m,
+                     ef_construction=args.ef_construction, lists=args.lists,
+                     concurrently=args.concurrently, **build)
+    elif args.command == "quantize":
+        create_index(engine, args.table, args.method, args.metric, m=args.m,
+                     ef_construction=args.ef_construction, lists=args.lists,
+                     concurrently=args.concurrently, quantization=args.quantization, **build)
+        if args.eval_queries:
+            evaluate_quantized(engine, args.table, args.metric, args.quantization, k=args.eval_k,
+                               n_queries=args.eval_queries, candidates=args.candidates)
+    elif args.command == "drop":
+        drop_index(engine, args.name)
+    elif args.command == "rebuild":
+        names = [args.name] if args.name else [n for n, _ in list_indexes(engine, args.table)]
+        for name in names:
+            rebuild_index(engine, name, **build)
+    elif args.command == "list":
+        for name, definition in list_indexes(engine, args.table):
+            print(f"{name}: {definition}")
+    elif args.command == "fts":
+        ensure_fts(engine, args.table, args.config)
+    elif args.command == "bulk-load":
+        ingest = importlib.import_module(args.ingest)
+        with bulk_load(engine, args.table, **build):
+            ingest.ingest_folder(args.folder)
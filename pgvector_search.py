@@ -0,0 +1,221 @@
+import os
+import hashlib
+import numpy as np
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+METRIC_OPERATORS = {
+    "cosine": "<=>",
+    "l2": "<->",
+    "inner": "<#>",
+}
+
+# Text search config used for documents.chunk_tsv (see pgvector_index.py fts)
+FTS_CONFIG = os.getenv("FTS_CONFIG", "english")
+# Candidates taken from each ranked list before fusion, and the RRF constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# First pass over a quantized expression index ("halfvec" or "bit"; empty =
+# the full-precision index), then this many candidates re-scored in float32
+QUANTIZATIONS = ("halfvec", "bit")
+PGVECTOR_QUANTIZATION = os.getenv("PGVECTOR_QUANTIZATION", "")
+RESCORE_CANDIDATES = int(os.getenv("RESCORE_CANDIDATES", "100"))
+
+try:
+    from pgvector.psycopg import register_vector  # binary vector params on psycopg 3
+except ImportError:
+    register_vector = None
+
+# ────────────────────────────────────────────────
+# HELPERS
+# ────────────────────────────────────────────────
+def vector_literal(embedding):
+    # pgvector's text input format
+    return "[" + ",".join(map(str, embedding)) + "]"
+
+
+def quantized_expression(quantization, dim, value="embedding"):
+    # Must match the expression the index was built on (see pgvector_index.py quantize)
+    if quantization == "halfvec":
+        return f"({value})::halfvec({int(dim)})"
+    if quantization == "bit":
+        return f"binary_quantize({value})::bit({int(dim)})"
+    raise ValueError(f"Unknown quantization: {quantization} (expected one of {', '.join(QUANTIZATIONS)})")
+
+
+def _dbapi(raw):
+    return getattr(raw, "dbapi_connection", None) or raw.connection
+
+
+def _is_psycopg3(raw):
+    return type(_dbapi(raw)).__module__.startswith("psycopg.")
+
+
+def _statement_name(sql):
+    return "rag_" + hashlib.md5(sql.encode("utf-8")).hexdigest()[:16]
+
+
+def _apply_settings(cur, ef_search, probes):
+    # set_config(..., true) is SET LOCAL: it only lasts for this transaction
+    if ef_search:
+        cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(int(ef_search)),))
+    if probes:
+        cur.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(int(probes)),))
+
+
+def _run_prepared(raw, cur, sql, param_types, params):
+    # SQL uses $1..$n. On psycopg 3 the driver prepares it and sends the
+    # vector as a binary parameter; on psycopg2 we PREPARE once per pooled
+    # connection and EXECUTE with the vector bound as a parameter.
+    if _is_psycopg3(raw):
+        binary = register_vector is not None
+        if binary and not raw.info.get("pgvector_registered"):
+            register_vector(_dbapi(raw))
+            raw.info["pgvector_registered"] = True
+        if not binary:
+            params = (vector_literal(params[0]),) + tuple(params[1:])
+        # Named placeholders: $1 appears more than once in most statements
+        casts = tuple(f"%(p{i})s::{t}" for i, t in enumerate(param_types, 1))
+        named = {f"p{i}": value for i, value in enumerate(params, 1)}
+        cur.execute(_to_pyformat(sql, casts), named, prepare=True, binary=binary)
+        return cur.fetchall()
+
+    name = _statement_name(sql)
+    prepared = raw.info.setdefault("prepared_statements", set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} ({', '.join(param_types)}) AS {sql}")
+        prepared.add(name)
+    params = (vector_literal(params[0]),) + tuple(params[1:])
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    return cur.fetchall()
+
+
+def _to_pyformat(sql, placeholders):
+    # $n → %(pn)s::type, highest index first so $1 doesn't clobber $10
+    for i in range(len(placeholders), 0, -1):
+        sql = sql.replace(f"${i}", placeholders[i - 1])
+    return sql
+
+def _query(engine, sql, param_types, params, ef_search=None, probes=None):
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        _apply_settings(cur, ef_search, probes)
+        rows = _run_prepared(raw, cur, sql, param_types, params)
+        cur.close()
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    return [tuple(r) for r in rows]
+
+# ────────────────────────────────────────────────
+# VECTOR SEARCH
+# ────────────────────────────────────────────────
+def search_sql(metric="cosine", columns=("doc_title", "chunk_text"), table="documents"):
+    # (sql, param types) for params (embedding, top_k); shared with async callers
+    operator = METRIC_OPERATORS.get(metric, "<=>")
+    sql = (
+        f"SELECT {', '.join(columns)}, embedding {operator} $1 AS distance "
+        f"FROM {table} ORDER BY embedding {operator} $1 LIMIT $2"
+    )
+    return sql, ("vector", "int")
+
+
+def quantized_sql(metric="cosine", columns=("doc_title", "chunk_text"), table="documents",
+                  quantization="halfvec", dim=1024):
+    # (sql, param types) for params (embedding, top_k, candidates): the inner
+    # query walks the compact index, the outer one re-ranks by float32 distance
+    operator = METRIC_OPERATORS.get(metric, "<=>")
+    # Sign bits only carry direction, so bit codes are compared by Hamming distance
+    first_operator = "<~>" if quantization == "bit" else operator
+    cols = ", ".join(columns)
+    row_code = quantized_expression(quantization, dim)
+    query_code = quantized_expression(quantization, dim, "$1")
+    sql = f"""
+        SELECT * FROM (
+            SELECT {cols}, embedding {operator} $1 AS distance FROM {table}
+            ORDER BY {row_code} {first_operator} {query_code} LIMIT $3
+        ) candidates
+        ORDER BY distance LIMIT $2
+    """
+    return sql, ("vector", "int", "int")
+
+
+def search(engine, embedding, top_k=5, metric="cosine", columns=("doc_title", "chunk_text"),
+           table="documents", ef_search=None, probes=None,
+           quantization=PGVECTOR_QUANTIZATION, rescore_candidates=RESCORE_CANDIDATES):
+    """Nearest chunks by `metric`, as rows of (*columns, distance).
+
+    The query vector is a bound parameter of a prepared statement on a pooled
+    connection, so Postgres parses and plans the query once per connection.
+    `ef_search` / `probes` set hnsw.ef_search / ivfflat.probes for this call only.
+    With `quantization`, `rescore_candidates` rows come from the halfvec/bit
+    index and only those are re-scored against the full-precision embedding.
+    """
+    embedding = np.asarray(embedding, dtype="float32")
+    if not quantization:
+        sql, types = search_sql(metric, columns, table)
+        return _query(engine, sql, types, (embedding, int(top_k)), ef_search, probes)
+
+    candidates = max(int(rescore_candidates), int(top_k))
+    sql, types = quantized_sql(metric, columns, table, quantization, len(embedding))
+    # An HNSW scan returns at most ef_search rows
+    ef_search = max(int(ef_search or 0), candidates)
+    return _query(engine, sql, types, (embedding, int(top_k), candidates), ef_search, probes)
+
+# ────────────────────────────────────────────────
+# HYBRID SEARCH
+# ────────────────────────────────────────────────
+def hybrid_sql(metric="cosine", columns=("doc_title", "chunk_text"), table="documents"):
+    # (sql, param types) for params (embedding, top_k, candidates, query_text, rrf_k)
+    operator = METRIC_OPERATORS.get(metric, "<=>")
+    cols = ", ".join(columns)
+    # Duplicates of a row carry identical values; array_agg works for any column type (min() has no uuid)
+    picked = ", ".join(f"(array_agg({c}))[1] AS {c}" for c in columns)
+    # ctid identifies a row within this one statement without assuming a key column
+    sql = f"""
+        WITH vec AS (
+            SELECT *, row_number() OVER (ORDER BY distance) AS rank FROM (
+                SELECT ctid AS row_id, {cols}, embedding {operator} $1 AS distance
+                FROM {table} ORDER BY embedding {operator} $1 LIMIT $3
+            ) v
+        ), lex AS (
+            SELECT row_id, {cols}, distance, row_number() OVER (ORDER BY lex_rank DESC) AS rank FROM (
+                SELECT ctid AS row_id, {cols}, embedding {operator} $1 AS distance,
+                       ts_rank_cd(chunk_tsv, q) AS lex_rank
+                FROM {table}, websearch_to_tsquery('{FTS_CONFIG}', $4) q
+                WHERE chunk_tsv @@ q
+                ORDER BY lex_rank DESC LIMIT $3
+            ) l
+        )
+        SELECT {picked}, min(distance) AS distance
+        FROM (
+            SELECT row_id, {cols}, distance, rank FROM vec
+            UNION ALL
+            SELECT row_id, {cols}, distance, rank FROM lex
+        ) ranked
+        GROUP BY row_id
+        ORDER BY sum(1.0 / ($5 + rank)) DESC
+        LIMIT $2
+    """
+    return sql, ("vector", "int", "int", "text", "int")
+
+
+def hybrid_search(engine, embedding, query_text, top_k=5, metric="cosine",
+                  columns=("doc_title", "chunk_text"), table="documents",
+                  candidates=HYBRID_CANDIDATES, rrf_k=RRF_K, ef_search=None, probes=None):
+    """Vector + full-text search fused with reciprocal rank fusion, in one query.
+
+    Each side contributes its top `candidates` rows; a row's score is the sum
+    of 1 / (rrf_k + rank) over the lists it appears in. Exact tokens such as
+    part numbers and standard IDs that embeddings blur still rank via
+    chunk_tsv. Rows are (*columns, distance), best fused score first.
+    """
+    sql, types = hybrid_sql(metric, columns, table)
+    embedding = np.asarray(embedding, dtype="float32")
+    params = (embedding, int(top_k), int(max(candidates, top_k)), query_text, int(rrf_k))
+    return _query(engine, sql, types, params, ef_search, probes)
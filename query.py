@@ -1,10 +1,12 @@
 # This code runs with proper dependences, Azure Key, and Postgresql config
 
 import os
-import numpy as np
-from sqlalchemy import create_engine, text
-from sentence_transformers import SentenceTransformer
-from openai import AzureOpenAI
+import pgvector_search
+from query_cache import QueryCache, index_version
+from context_packer import pack_context
+from rerank import Reranker
+from resources import Lazy, lazy_embedder, lazy_engine, lazy_azure_client
+import chunker
 
 # Azure OpenAI Setup
 endpoint = "#Azure_Endpoint"
@@ -12,31 +14,41 @@ deployment = "gpt-4o-mini"
 api_version = "2024-12-01-preview"
 api_key = os.getenv("AZURE_OPENAI_KEY")
 
-client = AzureOpenAI(
-    api_key=api_key,
-    api_version=api_version,
-    azure_endpoint=endpoint
-)
+client = lazy_azure_client(api_key, api_version, endpoint)
 
 # PostgreSQL
 PG_CONN_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
 if not PG_CONN_STRING:
     raise RuntimeError("POSTGRES_CONNECTION_STRING environment variable is not set.")
-engine = create_engine(PG_CONN_STRING)
-model = SentenceTransformer("intfloat/e5-base-v2")  # Make sure this matches your DB vector size
+# Engine, model and tokenizer load on first use (see resources.py)
+engine = lazy_engine(PG_CONN_STRING)
+model = lazy_embedder("intfloat/e5-base-v2")  # Make sure this matches your DB vector size
+query_cache = QueryCache()
+tokenizer = Lazy("cl100k_base tokenizer", chunker.get_encoding)
+reranker = Reranker()
+# Off unless HYBRID_SEARCH=1: needs the chunk_tsv column (python pgvector_index.py fts)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "0") == "1"
 
-def search_similar_chunks(user_query, top_k=5):
-    query_embedding = model.encode(user_query, normalize_embeddings=True).tolist()
-    embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
-    with engine.connect() as conn:
-        sql = text(f"""
-            SELECT filename, chunk_text, embedding <=> '{embedding_str}'::vector AS distance
-            FROM documents
-            ORDER BY distance ASC
-            LIMIT :top_k
-        """)
-        results = conn.execute(sql, {'top_k': top_k}).fetchall()
-        return results
+def search_similar_chunks(user_query, top_k=5, hybrid=HYBRID_SEARCH, ef_search=None, probes=None):
+    query_embedding = query_cache.embed(user_query, lambda q: model.encode(q, normalize_embeddings=True).tolist())
+
+    # Wider ANN candidate set, re-ranked down to top_k on CPU
+    candidates = reranker.candidate_count(top_k)
+
+    def run_search():
+        if hybrid:
+            return pgvector_search.hybrid_search(
+                engine, query_embedding, user_query, top_k=candidates, metric="cosine",
+                columns=("filename", "chunk_text", "chunk_id"), ef_search=ef_search, probes=probes,
+            )
+        return pgvector_search.search(
+            engine, query_embedding, top_k=candidates, metric="cosine",
+            columns=("filename", "chunk_text", "chunk_id"), ef_search=ef_search, probes=probes,
+        )
+
+    rows = query_cache.retrieve(query_embedding, candidates, "cosine", index_version(), run_search,
+                                extra=(hybrid, ef_search, probes))
+    return reranker.rerank(user_query, rows, top_k)
 
 def ask_openai(context, user_query):
     prompt = (
@@ -59,11 +71,13 @@ if __name__ == "__main__":
     while True:
         user_query = input("Ask your question (or type 'quit'): ")
         if user_query.lower().strip() == 'quit':
+            query_cache.log_stats()
             break
 
         try:
             results = search_similar_chunks(user_query)
-            context = "\n".join([r[1] for r in results])
+            # Neighbouring chunks of a file merged, overlap removed, within CONTEXT_TOKEN_BUDGET
+            context, _, _ = pack_context([(r[0], r[2], r[1], rank) for rank, r in enumerate(results)], tokenizer)
             answer = ask_openai(context, user_query)
             print(f"\n💡 Answer:\n{answer}\n")
         except Exception as e:
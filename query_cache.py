@@ -0,0 +1,160 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "1") == "1"
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "600"))
+
+# Ingest bumps this file after every write to the documents table; cached
+# retrieval results from an older version are never served
+INDEX_VERSION_PATH = os.getenv(
+    "INDEX_VERSION_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "ragtoriches", "index_version"),
+)
+
+# ────────────────────────────────────────────────
+# INDEX VERSION
+# ────────────────────────────────────────────────
+def index_version(path=INDEX_VERSION_PATH):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return "0"
+
+
+def bump_index_version(path=INDEX_VERSION_PATH):
+    # Unique per write, and swapped in atomically so readers never see it half-written
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    version = f"{time.time_ns()}-{os.getpid()}"
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    return version
+
+# ────────────────────────────────────────────────
+# HELPERS
+# ────────────────────────────────────────────────
+def normalize_query(query):
+    # "What is  FMEA?" and "what is fmea?" are the same question
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+def embedding_key(embedding):
+    return hashlib.sha256(np.asarray(embedding, dtype="float32").tobytes()).hexdigest()
+
+# ────────────────────────────────────────────────
+# LRU / TTL CACHE
+# ────────────────────────────────────────────────
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_items, ttl):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self.items[key]
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = (time.monotonic(), value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+# ────────────────────────────────────────────────
+# QUERY CACHE
+# ────────────────────────────────────────────────
+class QueryCache:
+    """Skips the encoder and the vector search for repeated questions.
+
+    `embed()` caches normalized query text → embedding. `retrieve()` caches
+    search results keyed by (embedding hash, top_k, metric, index version, extra);
+    pass the pgvector index_version() or a ResidentIndex's version so new
+    ingests and index builds invalidate stale results.
+    """
+
+    def __init__(self, enabled=QUERY_CACHE_ENABLED):
+        self.enabled = enabled
+        self.embeddings = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+        self.results = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL_SECONDS)
+
+    def embed(self, query, encode_fn):
+        embedding = self.cached_embedding(query)
+        if embedding is None:
+            embedding = encode_fn(query)
+            self.store_embedding(query, embedding)
+        return embedding
+
+    # Lookup/store halves of embed() and retrieve() for async callers, which
+    # can't hand over a blocking encode/search function. No-ops when disabled.
+    def cached_embedding(self, query):
+        return self.embeddings.get(normalize_query(query)) if self.enabled else None
+
+    def store_embedding(self, query, embedding):
+        if self.enabled:
+            self.embeddings.put(normalize_query(query), embedding)
+
+    def cached_results(self, key):
+        rows = self.results.get(key) if self.enabled else None
+        return None if rows is None else list(rows)
+
+    def store_results(self, key, rows):
+        if self.enabled:
+            self.results.put(key, rows)
+
+    def result_key(self, embedding, top_k, metric, version, extra=()):
+        return (embedding_key(embedding), top_k, metric, version) + tuple(extra)
+
+    def retrieve(self, embedding, top_k, metric, version, search_fn, extra=()):
+        key = self.result_key(embedding, top_k, metric, version, extra)
+        rows = self.cached_results(key)
+        if rows is None:
+            rows = search_fn()
+            self.store_results(key, rows)
+        else:
+            logging.info(f"⚡ Retrieval cache hit (index version {version})")
+        return list(rows)
+
+    def log_stats(self):
+        logging.info(
+            f"📊 Query cache: embeddings {self.embeddings.hit_rate:.0%} hit "
+            f"({self.embeddings.hits}/{self.embeddings.hits + self.embeddings.misses}), "
+            f"retrieval {self.results.hit_rate:.0%} hit "
+            f"({self.results.hits}/{self.results.hits + self.results.misses})"
+        )
@@ -1,11 +1,11 @@
 import os
-import faiss
-import pickle
-import numpy as np
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 import openai
+from faiss_store import ResidentIndex
+from query_cache import QueryCache
+from rerank import Reranker
+from resources import lazy_embedder
 
 # === Load environment variables ===
 load_dotenv()
@@ -15,6 +15,8 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 HDD_PATH = "/media/username/ExternalHDD/ai_vector/"
 FAISS_INDEX_PATH = os.path.join(HDD_PATH, "faiss.index")
 ID_MAP_PATH = os.path.join(HDD_PATH, "id_map.pkl")
+# Float32 vectors written by build_index.py; SQ/PQ index hits are re-scored from it
+VECTOR_SPOOL_PATH = os.path.join(HDD_PATH, "vectors")
 
 # === PostgreSQL config ===
 DB_CONFIG = {
@@ -26,37 +28,64 @@ DB_CONFIG = {
 }
 
 EMBED_DIM = 1024
-model = SentenceTransformer("intfloat/e5-large-v2")
+# Loaded on first query, like the index and the connection pool below
+model = lazy_embedder("intfloat/e5-large-v2")
+
+# Loaded on first query and kept resident; reloads itself when build_index.py
+# writes a new index file. The index returns chunks.id directly; ID_MAP_PATH is
+# only read for indexes built before id mapping.
+faiss_index = ResidentIndex(FAISS_INDEX_PATH, legacy_id_map_path=ID_MAP_PATH, spool_path=VECTOR_SPOOL_PATH)
+db_pool = None
+query_cache = QueryCache()
+reranker = Reranker()
+
+def get_db_pool():
+    global db_pool
+    if db_pool is None:
+        db_pool = ThreadedConnectionPool(1, int(os.getenv("DB_POOL_SIZE", "5")), **DB_CONFIG)
+    return db_pool
 
 def retrieve_chunks_faiss(query, top_k=5):
-    # Embed query
-    query_vec = model.encode(f"query: {query}", normalize_embeddings=True).astype("float32").reshape(1, -1)
+    # Embed query (cached per normalized question)
+    query_vec = query_cache.embed(
+        query, lambda q: model.encode(f"query: {q}", normalize_embeddings=True).astype("float32").reshape(1, -1)
+    )
 
-    # Load FAISS index and ID map
-    index = faiss.read_index(FAISS_INDEX_PATH)
-    with open(ID_MAP_PATH, "rb") as f:
-        id_map = pickle.load(f)
+    # Results are keyed on the loaded index file's version, so a rebuild or
+    # delete in build_index.py invalidates them
+    faiss_index.refresh()
+    # Cheap wide FAISS candidate set, re-ranked down to top_k by the cross-encoder
+    candidates = reranker.candidate_count(top_k)
+    rows = query_cache.retrieve(query_vec, candidates, "ip", faiss_index.version,
+                                lambda: fetch_chunks(query_vec, candidates))
+    return reranker.rerank(query, rows, top_k, text_of=lambda row: row[0])
 
-    # Search
-    D, I = index.search(query_vec, top_k)
-    matched_ids = [id_map[i] for i in I[0]]
+def fetch_chunks(query_vec, top_k):
+    # Search the resident index
+    _, matched_ids = faiss_index.search(query_vec, top_k)
 
-    # Retrieve metadata from PostgreSQL
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT content, page FROM chunks WHERE id = ANY(%s);", (matched_ids,)
-    )
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-    return results
+    # Retrieve metadata from PostgreSQL over a pooled connection
+    pool = get_db_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, content, page FROM chunks WHERE id = ANY(%s);", (matched_ids,)
+            )
+            rows = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+    # Keep FAISS rank order
+    return [rows[i] for i in matched_ids if i in rows]
 
 # === CLI Interface ===
 if __name__ == "__main__":
+    faiss_index.refresh()  # load up front so the first question isn't slower
     while True:
         query = input("🔍 Ask a question (or 'exit'): ")
         if query.lower() == "exit":
+            query_cache.log_stats()
             break
 
         results = retrieve_chunks_faiss(query)
@@ -1,10 +1,16 @@
 import os
+import time
 import logging
 from datetime import datetime
-from sqlalchemy import create_engine, text
-from sentence_transformers import SentenceTransformer
-from openai import AzureOpenAI
-import tiktoken
+import pgvector_search
+from query_cache import QueryCache, index_version
+from answer_cache import AnswerCache, chunk_hash, context_key
+from llm_stream import StreamedAnswer
+from context_packer import pack_context
+from telemetry import TelemetryWriter
+from rerank import Reranker
+from resources import Lazy, lazy_embedder, lazy_engine, lazy_azure_client
+import chunker
 
 # ────────────────────────────────────────────────
 # CONFIG & LOGGING
@@ -14,43 +20,62 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(
 PG_CONN_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
 if not PG_CONN_STRING:
     raise RuntimeError("❌ POSTGRES_CONNECTION_STRING is not set.")
-engine = create_engine(PG_CONN_STRING)
+engine = lazy_engine(PG_CONN_STRING)
 
 AZURE_API_KEY = os.getenv("AZURE_OPENAI_KEY")
 AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "endpoint")
 API_VERSION = "2024-12-01-preview"
 
-client = AzureOpenAI(
-    api_key=AZURE_API_KEY,
-    api_version=API_VERSION,
-    azure_endpoint=AZURE_ENDPOINT,
+client = lazy_azure_client(AZURE_API_KEY, API_VERSION, AZURE_ENDPOINT)
+
+# Heavy resources load on first use (see resources.py), so imports and env checks stay fast
+EMBED_MODEL = "intfloat/e5-mistral-7b-instruct"
+embedder = lazy_embedder(EMBED_MODEL)  # 1048-dim
+tokenizer = Lazy("cl100k_base tokenizer", chunker.get_encoding)
+
+# Off unless HYBRID_SEARCH=1: needs the chunk_tsv column (python pgvector_index.py fts)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "0") == "1"
+# Print answers token by token as they arrive instead of after the full completion
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+
+query_cache = QueryCache()
+answer_cache = AnswerCache()
+# CPU cross-encoder over the ANN candidates; model loads on first query
+reranker = Reranker()
+# Feedback rows are batched into the table by a background thread
+feedback_writer = TelemetryWriter(
+    engine, "feedback", ["query", "answer", "user_feedback", "query_time", "prompt_tokens", "model"]
 )
 
-embedder = SentenceTransformer("intfloat/e5-mistral-7b-instruct")  # 1048-dim
-tokenizer = tiktoken.get_encoding("cl100k_base")
-
 # ────────────────────────────────────────────────
 # VECTOR SEARCH
 # ────────────────────────────────────────────────
-def search_similar_chunks(query, top_k=5, metric="cosine"):
-    embedding = embedder.encode(query, normalize_embeddings=True).tolist()
-    embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
-
-    operator = {
-        "cosine": "<=>",
-        "l2": "<->",
-        "inner": "<#>"
-    }.get(metric, "<=>")
-
-    with engine.connect() as conn:
-        rows = conn.execute(text(f"""
-            SELECT doc_title, chunk_text, {embedding_str}::vector {operator} embedding AS distance
-            FROM documents
-            ORDER BY distance ASC
-            LIMIT :top_k
-        """), {"top_k": top_k}).fetchall()
-
-    return rows, embedding
+# doc_id + chunk_id let the context packer merge neighbouring chunks
+SEARCH_COLUMNS = ("doc_title", "chunk_text", "doc_id", "chunk_id")
+
+def search_similar_chunks(query, top_k=5, metric="cosine", hybrid=HYBRID_SEARCH,
+                          ef_search=None, probes=None):
+    # Repeated questions skip the encoder, and the database until ingest bumps the index version
+    embedding = query_cache.embed(query, lambda q: embedder.encode(q, normalize_embeddings=True).tolist())
+
+    # A wider, cheap ANN candidate set, narrowed to top_k by the cross-encoder
+    candidates = reranker.candidate_count(top_k)
+
+    def run_search():
+        if hybrid:
+            # Vector + full-text ranks fused in Postgres; catches exact part numbers/IDs
+            return pgvector_search.hybrid_search(
+                engine, embedding, query, top_k=candidates, metric=metric,
+                columns=SEARCH_COLUMNS, ef_search=ef_search, probes=probes,
+            )
+        return pgvector_search.search(
+            engine, embedding, top_k=candidates, metric=metric,
+            columns=SEARCH_COLUMNS, ef_search=ef_search, probes=probes,
+        )
+
+    rows = query_cache.retrieve(embedding, candidates, metric, index_version(), run_search,
+                                extra=(hybrid, ef_search, probes))
+    return reranker.rerank(query, rows, top_k), embedding
 
 # ────────────────────────────────────────────────
 # MODEL SELECTION LOGIC
@@ -66,50 +91,86 @@ def select_model(token_count):
 # ────────────────────────────────────────────────
 # GPT CALL
 # ────────────────────────────────────────────────
-def ask_openai(context, user_query):
-    prompt = (
-        "You are a System Safety engineer and an expert analyst. "
-        "Use the provided context to answer the question precisely and concisely.\n\n"
-        f"Context:\n{context}\n\n"
-        f"User Question: {user_query}\n\nAnswer:"
-    )
+PROMPT_TEMPLATE = (
+    "You are a System Safety engineer and an expert analyst. "
+    "Use the provided context to answer the question precisely and concisely.\n\n"
+    "Context:\n{context}\n\n"
+    "User Question: {question}\n\nAnswer:"
+)
 
-    token_count = len(tokenizer.encode(prompt))
+def pack_chunks(chunks):
+    # Merged, de-overlapped, best-first context within CONTEXT_TOKEN_BUDGET;
+    # returns (context, context_tokens, chunks actually used)
+    # Chunks arrive best-first (re-ranked or fused), so rank orders the passages
+    hits = [(doc_id, chunk_id, chunk_text, rank)
+            for rank, (_, chunk_text, doc_id, chunk_id, _) in enumerate(chunks)]
+    context, context_tokens, used = pack_context(hits, tokenizer)
+    return context, context_tokens, [chunks[i] for i in used]
+
+def ask_openai(context, user_query, chunk_hashes=None, query_embedding=None, stream=False,
+               context_tokens=None):
+    # With stream=True the answer comes back as a StreamedAnswer: iterate it for
+    # text pieces, then read .text. Prompt token accounting is the same either way.
+    prompt = PROMPT_TEMPLATE.format(context=context, question=user_query)
+
+    if context_tokens is not None:
+        # Context was already tokenized by the packer; only count the rest
+        token_count = context_tokens + len(tokenizer.encode(PROMPT_TEMPLATE.format(context="", question=user_query)))
+    else:
+        token_count = len(tokenizer.encode(prompt))
     logging.info(f"🔢 Prompt tokens: {token_count}")
 
     model_to_use = select_model(token_count)
     logging.info(f"🤖 Using model: {model_to_use}")
 
+    # Same model + template + retrieved chunks (+ same or near-identical question) → same answer
+    cache_key = None
+    if chunk_hashes is not None:
+        cache_key = context_key(model_to_use, PROMPT_TEMPLATE, chunk_hashes, EMBED_MODEL)
+        cached = answer_cache.get(cache_key, user_query, query_embedding)
+        if cached is not None:
+            if stream:
+                return StreamedAnswer.from_text(cached[0]), cached[1], cached[2]
+            return cached
+
+    start = time.perf_counter()
+    if stream:
+        def cache_answer(streamed):
+            if cache_key is not None:
+                answer_cache.put(cache_key, user_query, streamed.text, token_count, model_to_use,
+                                 streamed.total, query_embedding)
+
+        response = client.chat.completions.create(
+            model=model_to_use,
+            messages=[{"role": "system", "content": prompt}],
+            max_tokens=800,
+            temperature=0.3,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        return StreamedAnswer(response, start, on_complete=cache_answer), token_count, model_to_use
+
     response = client.chat.completions.create(
         model=model_to_use,
         messages=[{"role": "system", "content": prompt}],
         max_tokens=800,
         temperature=0.3
     )
+    latency = time.perf_counter() - start
 
     answer = response.choices[0].message.content
+    if cache_key is not None:
+        answer_cache.put(cache_key, user_query, answer, token_count, model_to_use, latency, query_embedding)
     return answer, token_count, model_to_use
 
 # ────────────────────────────────────────────────
 # STORE FEEDBACK / METADATA
 # ────────────────────────────────────────────────
 def store_feedback(query, answer, feedback, prompt_tokens, model_used):
-    with engine.connect() as conn:
-        conn.execute(text("""
-            INSERT INTO feedback (
-                query, answer, user_feedback,
-                query_time, prompt_tokens, model
-            ) VALUES (
-                :q, :a, :f, :qt, :pt, :m
-            )
-        """), {
-            "q": query,
-            "a": answer,
-            "f": feedback,
-            "qt": datetime.utcnow(),
-            "pt": prompt_tokens,
-            "m": model_used
-        })
+    if feedback == "no":
+        # Never serve a rejected answer from the cache again
+        answer_cache.reject(answer)
+    feedback_writer.record((query, answer, feedback, datetime.utcnow(), prompt_tokens, model_used))
 
 # ────────────────────────────────────────────────
 # MAIN CLI LOOP
@@ -118,6 +179,9 @@ if __name__ == "__main__":
     while True:
         user_query = input("\n🔎 Enter your question (or type 'quit'): ").strip()
         if user_query.lower() == "quit":
+            query_cache.log_stats()
+            answer_cache.close()
+            feedback_writer.close()
             break
 
         try:
@@ -128,12 +192,25 @@ if __name__ == "__main__":
                 print("⚠️ Sorry, no context found.")
                 continue
 
-            context = "\n".join([chunk[1] for chunk in chunks])
-            for i, (title, text, distance) in enumerate(chunks):
+            context, context_tokens, used_chunks = pack_chunks(chunks)
+            for i, (title, _, _, _, distance) in enumerate(chunks):
                 logging.info(f"📄 Match {i+1}: '{title}' | Distance: {distance:.4f}")
 
-            answer, prompt_tokens, model_used = ask_openai(context, user_query)
-            print(f"\n💡 Answer:\n{answer}")
+            answer, prompt_tokens, model_used = ask_openai(
+                context, user_query,
+                chunk_hashes=[chunk_hash(chunk[1]) for chunk in used_chunks],
+                query_embedding=query_embedding,
+                stream=STREAM_ANSWERS,
+                context_tokens=context_tokens,
+            )
+            if STREAM_ANSWERS:
+                print("\n💡 Answer:")
+                for piece in answer:
+                    print(piece, end="", flush=True)
+                print()
+                answer = answer.text
+            else:
+                print(f"\n💡 Answer:\n{answer}")
 
             fb = input("\nWas this helpful? (yes/no/skip): ").strip().lower()
             if fb in ["yes", "no"]:
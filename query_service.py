@@ -0,0 +1,533 @@
+import os
+import re
+import time
+import json
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import asyncpg
+import tiktoken
+from aiohttp import web, ClientSession
+from openai import AsyncAzureOpenAI, AsyncOpenAI
+import pgvector_search
+from query_cache import QueryCache, index_version
+from answer_cache import AnswerCache, chunk_hash, context_key
+from llm_stream import AsyncStreamedAnswer
+from context_packer import pack_context
+from rerank import Reranker
+from resources import embedding_model
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+SERVICE_HOST = os.getenv("QUERY_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("QUERY_SERVICE_PORT", "8000"))  # pages/index.tsx posts here
+CORS_ORIGIN = os.getenv("QUERY_SERVICE_CORS_ORIGIN", "*")
+
+EMBED_MODEL_NAME = os.getenv("QUERY_EMBED_MODEL", "intfloat/e5-mistral-7b-instruct")
+TOP_K = int(os.getenv("QUERY_TOP_K", "5"))
+# Off unless HYBRID_SEARCH=1: needs the chunk_tsv column (python pgvector_index.py fts)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "0") == "1"
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+# Encoder calls run on these threads; concurrent questions are encoded together
+ENCODE_THREADS = int(os.getenv("ENCODE_THREADS", "1"))
+ENCODE_MAX_BATCH = int(os.getenv("ENCODE_MAX_BATCH", "32"))
+ENCODE_BATCH_WAIT_MS = float(os.getenv("ENCODE_BATCH_WAIT_MS", "5"))
+# In-flight chat completions; keeps bursts under the deployment's rate limit
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))
+
+AZURE_API_KEY = os.getenv("AZURE_OPENAI_KEY")
+AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "endpoint")
+API_VERSION = "2024-12-01-preview"
+
+PROMPT_TEMPLATE = (
+    "You are a System Safety engineer and an expert analyst. "
+    "Use the provided context to answer the question precisely and concisely.\n\n"
+    "Context:\n{context}\n\n"
+    "User Question: {question}\n\nAnswer:"
+)
+NO_CONTEXT_ANSWER = "⚠️ Sorry, no context found."
+
+
+def select_model(token_count):
+    if token_count < 800:
+        return "gpt-3.5-turbo"
+    elif token_count < 1800:
+        return "gpt-4o-mini"
+    else:
+        return "gpt-4o"
+
+
+def asyncpg_dsn(conn_string):
+    # POSTGRES_CONNECTION_STRING is a SQLAlchemy URL; asyncpg wants plain postgresql://
+    return re.sub(r"^postgresql\+\w+://", "postgresql://", conn_string)
+
+# ────────────────────────────────────────────────
+# QUERY ENCODER
+# ────────────────────────────────────────────────
+class QueryEncoder:
+    """Encodes questions off the event loop, batching concurrent ones.
+
+    Requests that arrive within ENCODE_BATCH_WAIT_MS of each other share one
+    model.encode call on the executor, so the encoder never serializes them.
+    """
+
+    def __init__(self, model, executor, max_batch=ENCODE_MAX_BATCH, wait_ms=ENCODE_BATCH_WAIT_MS):
+        self.model = model
+        self.executor = executor
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def encode(self, text):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(self.wait)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            texts = [t for t, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(
+                    self.executor,
+                    lambda: self.model.encode(texts, batch_size=len(texts), normalize_embeddings=True),
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector.tolist())
+
+# ────────────────────────────────────────────────
+# QUERY SERVICE
+# ────────────────────────────────────────────────
+class QueryService:
+    """Answers questions concurrently: encode → pgvector search → chat completion.
+
+    Each stage awaits without blocking the loop (encoder on an executor,
+    asyncpg pool, AsyncAzureOpenAI), so throughput grows with the number of
+    requests in flight. `llm_base_url` points the client at an OpenAI-compatible
+    stub instead of Azure, e.g. `python query_service.py stub-llm`.
+    """
+
+    def __init__(self, conn_string, llm_base_url=None):
+        self.conn_string = conn_string
+        self.llm_base_url = llm_base_url
+        self.executor = ThreadPoolExecutor(max_workers=ENCODE_THREADS + 2, thread_name_prefix="query-service")
+        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.query_cache = QueryCache()
+        self.answer_cache = AnswerCache()
+        self.reranker = Reranker()
+        self.llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+        self.pool = None
+        self.client = None
+        self.encoder = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # EMBED_BACKEND=onnx-int8 serves the encoder from a quantized ONNX model on CPU
+        model = await loop.run_in_executor(self.executor, embedding_model, EMBED_MODEL_NAME)
+        self.encoder = QueryEncoder(model, self.executor)
+        self.encoder.start()
+        # A quantized first pass needs the HNSW scan to yield every rescoring candidate;
+        # as a startup setting it survives the pool's RESET ALL on release
+        settings = {}
+        if pgvector_search.PGVECTOR_QUANTIZATION:
+            settings["hnsw.ef_search"] = str(pgvector_search.RESCORE_CANDIDATES)
+        self.pool = await asyncpg.create_pool(
+            asyncpg_dsn(self.conn_string), min_size=DB_POOL_MIN, max_size=DB_POOL_SIZE,
+            init=self._init_connection, server_settings=settings,
+        )
+        if self.llm_base_url:
+            self.client = AsyncOpenAI(base_url=self.llm_base_url, api_key="stub")
+        else:
+            self.client = AsyncAzureOpenAI(
+                api_key=AZURE_API_KEY, api_version=API_VERSION, azure_endpoint=AZURE_ENDPOINT
+            )
+        logging.info(f"🚀 Query service ready ({EMBED_MODEL_NAME}, pool {DB_POOL_SIZE}, LLM slots {LLM_CONCURRENCY})")
+
+    @staticmethod
+    async def _init_connection(conn):
+        # Vector parameters are sent in pgvector's text format
+        await conn.set_type_codec(
+            "vector", encoder=pgvector_search.vector_literal, decoder=str, schema="public", format="text"
+        )
+
+    async def close(self):
+        await self.encoder.stop()
+        await self.pool.close()
+        await self.client.close()
+        self.answer_cache.close()
+        self.query_cache.log_stats()
+        self.executor.shutdown(wait=False)
+
+    async def embed(self, question):
+        embedding = self.query_cache.cached_embedding(question)
+        if embedding is None:
+            embedding = await self.encoder.encode(question)
+            self.query_cache.store_embedding(question, embedding)
+        return embedding
+
+    async def search(self, embedding, question, top_k, hybrid):
+        key = self.query_cache.result_key(embedding, top_k, "cosine", index_version(), extra=(hybrid,))
+        rows = self.query_cache.cached_results(key)
+        if rows is not None:
+            return rows
+        columns = ("doc_title", "chunk_text", "doc_id", "chunk_id")
+        if hybrid:
+            sql, _ = pgvector_search.hybrid_sql("cosine", columns)
+            params = (embedding, top_k, max(pgvector_search.HYBRID_CANDIDATES, top_k), question,
+                      pgvector_search.RRF_K)
+        elif pgvector_search.PGVECTOR_QUANTIZATION:
+            sql, _ = pgvector_search.quantized_sql("cosine", columns, quantization=pgvector_search.PGVECTOR_QUANTIZATION,
+                                                   dim=len(embedding))
+            params = (embedding, top_k, max(pgvector_search.RESCORE_CANDIDATES, top_k))
+        else:
+            sql, _ = pgvector_search.search_sql("cosine", columns)
+            params = (embedding, top_k)
+        # asyncpg prepares and caches the statement per pooled connection
+        async with self.pool.acquire() as conn:
+            records = await conn.fetch(sql, *params)
+        rows = [tuple(r) for r in records]
+        self.query_cache.store_results(key, rows)
+        return rows
+
+    def _prepare(self, question, chunks, embedding):
+        # Tokenizing and the SQLite cache lookup are blocking; run on the executor
+        context, context_tokens, used = pack_context(
+            # chunks are best-first after re-ranking, so rank orders the passages
+            [(doc_id, chunk_id, chunk_text, rank)
+             for rank, (_, chunk_text, doc_id, chunk_id, _) in enumerate(chunks)],
+            self.tokenizer,
+        )
+        prompt = PROMPT_TEMPLATE.format(context=context, question=question)
+        token_count = context_tokens + len(self.tokenizer.encode(PROMPT_TEMPLATE.format(context="", question=question)))
+        model = select_model(token_count)
+        key = context_key(model, PROMPT_TEMPLATE, [chunk_hash(chunks[i][1]) for i in used], EMBED_MODEL_NAME)
+        cached = self.answer_cache.get(key, question, embedding)
+        return prompt, token_count, model, key, cached
+
+    async def _retrieve(self, question, hybrid, top_k, timings):
+        loop = asyncio.get_running_loop()
+        mark = time.perf_counter()
+        embedding = await self.embed(question)
+        timings["encode_ms"] = (time.perf_counter() - mark) * 1000
+
+        mark = time.perf_counter()
+        candidates = await self.search(embedding, question, self.reranker.candidate_count(top_k), hybrid)
+        timings["search_ms"] = (time.perf_counter() - mark) * 1000
+
+        # Cross-encoder scoring is CPU-bound; keep it off the event loop
+        mark = time.perf_counter()
+        chunks = await loop.run_in_executor(self.executor, self.reranker.rerank, question, candidates, top_k)
+        timings["rerank_ms"] = (time.perf_counter() - mark) * 1000
+        if not chunks:
+            return chunks, None
+        prepared = await loop.run_in_executor(self.executor, self._prepare, question, chunks, embedding)
+        return chunks, prepared + (embedding,)
+
+    @staticmethod
+    def _result(answer, model, token_count, cached, chunks, timings):
+        return {
+            "answer": answer,
+            "model": model,
+            "prompt_tokens": token_count,
+            "cached": cached,
+            "sources": [{"title": c[0], "chunk_id": c[3], "distance": float(c[-1])} for c in chunks],
+            "timings": timings,
+        }
+
+    async def answer(self, question, hybrid=HYBRID_SEARCH, top_k=TOP_K):
+        loop = asyncio.get_running_loop()
+        timings = {}
+        start = time.perf_counter()
+        chunks, prepared = await self._retrieve(question, hybrid, top_k, timings)
+        if prepared is None:
+            timings["total_ms"] = (time.perf_counter() - start) * 1000
+            return {"answer": NO_CONTEXT_ANSWER, "sources": [], "timings": timings}
+        prompt, token_count, model, key, cached, embedding = prepared
+
+        mark = time.perf_counter()
+        if cached is not None:
+            answer, token_count, model = cached
+        else:
+            async with self.llm_slots:
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "system", "content": prompt}],
+                    max_tokens=800,
+                    temperature=0.3,
+                )
+            answer = response.choices[0].message.content
+            latency = time.perf_counter() - mark
+            await loop.run_in_executor(
+                self.executor, self.answer_cache.put, key, question, answer, token_count, model, latency, embedding
+            )
+        timings["llm_ms"] = (time.perf_counter() - mark) * 1000
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        return self._result(answer, model, token_count, cached is not None, chunks, timings)
+
+    async def answer_stream(self, question, hybrid=HYBRID_SEARCH, top_k=TOP_K):
+        # Yields {"token": ...} events as the completion arrives, then one final
+        # event shaped like answer()'s result with time-to-first-token added
+        loop = asyncio.get_running_loop()
+        timings = {}
+        start = time.perf_counter()
+        chunks, prepared = await self._retrieve(question, hybrid, top_k, timings)
+        if prepared is None:
+            timings["total_ms"] = (time.perf_counter() - start) * 1000
+            yield {"token": NO_CONTEXT_ANSWER}
+            yield {"done": True, "answer": NO_CONTEXT_ANSWER, "sources": [], "timings": timings}
+            return
+        prompt, token_count, model, key, cached, embedding = prepared
+
+        llm_start = time.perf_counter()
+        if cached is not None:
+            answer, token_count, model = cached
+            streamed = AsyncStreamedAnswer.from_text(answer)
+            async for piece in streamed:
+                yield {"token": piece}
+        else:
+            # Time to first token includes any wait for an LLM slot
+            async with self.llm_slots:
+                stream = await self.client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "system", "content": prompt}],
+                    max_tokens=800,
+                    temperature=0.3,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                streamed = AsyncStreamedAnswer(stream, llm_start)
+                async for piece in streamed:
+                    yield {"token": piece}
+            await loop.run_in_executor(
+                self.executor, self.answer_cache.put, key, question, streamed.text, token_count, model,
+                streamed.total, embedding
+            )
+        first_token = streamed.ttft if streamed.ttft is not None else streamed.total
+        timings["first_token_ms"] = (llm_start - start + first_token) * 1000
+        timings["llm_ms"] = streamed.total * 1000
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        result = self._result(streamed.text, model, token_count, cached is not None, chunks, timings)
+        result["completion_tokens"] = streamed.completion_tokens(self.tokenizer)
+        yield dict(result, done=True)
+
+# ────────────────────────────────────────────────
+# HTTP APP
+# ────────────────────────────────────────────────
+@web.middleware
+async def cors(request, handler):
+    # The Next.js UI runs on a different port
+    if request.method == "OPTIONS":
+        response = web.Response()
+    else:
+        response = await handler(request)
+    if response.prepared:
+        return response  # streamed responses set their own headers
+    response.headers["Access-Control-Allow-Origin"] = CORS_ORIGIN
+    response.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    return response
+
+
+async def handle_ask(request):
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return web.json_response({"error": "request body must be JSON"}, status=400)
+    if not isinstance(body, dict):
+        return web.json_response({"error": "request body must be a JSON object"}, status=400)
+    question = str(body.get("question") or "").strip()
+    if not question:
+        return web.json_response({"error": "question is required"}, status=400)
+    # `filter` from the UI is accepted but not applied yet
+    try:
+        result = await request.app["service"].answer(question, hybrid=bool(body.get("hybrid", HYBRID_SEARCH)))
+    except Exception as e:
+        logging.exception(f"❌ /ask failed: {e}")
+        return web.json_response({"error": str(e)}, status=500)
+    logging.info(f"💬 Answered in {result['timings']['total_ms']:.0f} ms")
+    return web.json_response(result)
+
+
+async def handle_ask_stream(request):
+    # Newline-delimited JSON: {"token": ...} lines, then a final {"done": true, ...}
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return web.json_response({"error": "request body must be JSON"}, status=400)
+    if not isinstance(body, dict):
+        return web.json_response({"error": "request body must be a JSON object"}, status=400)
+    question = str(body.get("question") or "").strip()
+    if not question:
+        return web.json_response({"error": "question is required"}, status=400)
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    response.headers["Access-Control-Allow-Origin"] = CORS_ORIGIN
+    await response.prepare(request)
+    try:
+        async for event in request.app["service"].answer_stream(
+            question, hybrid=bool(body.get("hybrid", HYBRID_SEARCH))
+        ):
+            await response.write((json.dumps(event) + "\n").encode("utf-8"))
+    except Exception as e:
+        # Headers are already sent, so the error goes in-band
+        logging.exception(f"❌ /ask/stream failed: {e}")
+        await response.write((json.dumps({"error": str(e), "done": True}) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+def make_app(service):
+    app = web.Application(middlewares=[cors])
+    app["service"] = service
+    app.router.add_route("*", "/ask", handle_ask)
+    app.router.add_route("*", "/ask/stream", handle_ask_stream)
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        await service.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+# ────────────────────────────────────────────────
+# STUB LLM + LOAD TEST
+# ────────────────────────────────────────────────
+def make_stub_llm_app(delay_seconds, answer="This is a stub answer from the fake LLM server."):
+    # OpenAI-compatible /chat/completions that sleeps like a real model would;
+    # with stream=true the delay is split across server-sent word chunks
+    async def completions(request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        words = answer.split(" ")
+        usage = {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}
+        if not body.get("stream"):
+            await asyncio.sleep(delay_seconds)
+            return web.json_response({
+                "id": "stub-completion",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(choices, usage=None):
+            chunk = {"id": "stub-completion", "object": "chat.completion.chunk",
+                     "created": int(time.time()), "model": model, "choices": choices, "usage": usage}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay_seconds / len(words))
+            piece = word if i == 0 else " " + word
+            await send([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/chat/completions", completions)
+    app.router.add_post("/v1/chat/completions", completions)
+    return app
+
+
+async def run_benchmark(url, questions, total, concurrency):
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(session, i):
+        async with slots:
+            start = time.perf_counter()
+            async with session.post(url, json={"question": questions[i % len(questions)]}) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    logging.warning(f"⚠️ HTTP {resp.status}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(one(session, i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"📈 {total} requests @ concurrency {concurrency}: {total / elapsed:.1f} req/s | "
+        f"p50 {np.percentile(latencies, 50):.0f} ms | p99 {np.percentile(latencies, 99):.0f} ms"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Async HTTP query service for the RAG pipeline.")
+    sub = parser.add_subparsers(dest="command")
+
+    serve = sub.add_parser("serve", help="serve POST /ask (default)")
+    serve.add_argument("--host", default=SERVICE_HOST)
+    serve.add_argument("--port", type=int, default=SERVICE_PORT)
+    serve.add_argument("--stub-llm", default=None, metavar="URL",
+                       help="OpenAI-compatible base URL to use instead of Azure")
+
+    stub = sub.add_parser("stub-llm", help="run a fake chat completions server")
+    stub.add_argument("--port", type=int, default=8001)
+    stub.add_argument("--delay", type=float, default=1.0, help="seconds per completion")
+
+    bench = sub.add_parser("bench", help="fire concurrent questions at a running service")
+    bench.add_argument("--url", default=f"http://{SERVICE_HOST}:{SERVICE_PORT}/ask")
+    bench.add_argument("--requests", type=int, default=100)
+    bench.add_argument("--concurrency", type=int, default=16)
+    bench.add_argument("questions", nargs="*", default=["What is a hazard analysis?"])
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "stub-llm":
+        web.run_app(make_stub_llm_app(args.delay), host="127.0.0.1", port=args.port)
+    elif args.command == "bench":
+        asyncio.run(run_benchmark(args.url, args.questions, args.requests, args.concurrency))
+    else:
+        conn_string = os.getenv("POSTGRES_CONNECTION_STRING")
+        if not conn_string:
+            raise RuntimeError("❌ POSTGRES_CONNECTION_STRING is not set.")
+        host = getattr(args, "host", SERVICE_HOST)
+        port = getattr(args, "port", SERVICE_PORT)
+        service = QueryService(conn_string, llm_base_url=getattr(args, "stub_llm", None))
+        web.run_app(make_app(service), host=host, port=port)
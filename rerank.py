@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+import threading
+from query_cache import TTLCache, normalize_query
+from answer_cache import chunk_hash
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "1") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# ANN hits fetched for re-ranking, at most
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+# Scoring time allowed per query; the candidate count shrinks to fit it
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+RERANK_CACHE_TTL_SECONDS = float(os.getenv("RERANK_CACHE_TTL_SECONDS", "86400"))
+# Weight of the newest measurement in the per-pair latency estimate
+_LATENCY_SMOOTHING = 0.3
+
+# ────────────────────────────────────────────────
+# RERANKER
+# ────────────────────────────────────────────────
+class Reranker:
+    """Re-orders ANN candidates with a small CPU cross-encoder.
+
+    Pairs are scored in batches of RERANK_BATCH_SIZE. A running estimate of
+    milliseconds per pair decides how many candidates fit in the latency
+    budget, and scoring also stops between batches once the budget is spent;
+    candidates left unscored keep their ANN order after the scored ones.
+    Scores are cached per (normalized query, chunk hash).
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, budget_ms=RERANK_BUDGET_MS,
+                 batch_size=RERANK_BATCH_SIZE, enabled=RERANK_ENABLED):
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self.cache = TTLCache(RERANK_CACHE_SIZE, RERANK_CACHE_TTL_SECONDS)
+        self.ms_per_pair = None
+        self.lock = threading.Lock()
+        self._model = None
+
+    @property
+    def model(self):
+        # Loaded on first use so scripts that never re-rank don't pay for it
+        if self._model is None:
+            with self.lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _affordable(self):
+        if self.ms_per_pair is None:
+            return self.batch_size  # first query: one batch to measure
+        return max(1, int(self.budget_ms / self.ms_per_pair))
+
+    def rerank(self, query, candidates, top_k, text_of=lambda row: row[1]):
+        # `candidates` are rows in ANN order; returns the best `top_k` rows
+        if not self.enabled or len(candidates) <= 1:
+            return list(candidates[:top_k])
+
+        # Load before the clock starts; a cold load is not per-pair latency
+        model = self.model
+        start = time.perf_counter()
+        key_query = normalize_query(query)
+        keys = [(key_query, chunk_hash(text_of(row))) for row in candidates]
+        scores = {}
+        todo = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is not None:
+                scores[i] = cached
+            else:
+                todo.append(i)
+
+        todo = todo[:self._affordable()]
+        scored = 0
+        for b in range(0, len(todo), self.batch_size):
+            if b and (time.perf_counter() - start) * 1000 >= self.budget_ms:
+                break
+            batch = todo[b:b + self.batch_size]
+            batch_start = time.perf_counter()
+            values = model.predict(
+                [(query, text_of(candidates[i])) for i in batch], batch_size=self.batch_size
+            )
+            per_pair = (time.perf_counter() - batch_start) * 1000 / len(batch)
+            self.ms_per_pair = per_pair if self.ms_per_pair is None else \
+                (1 - _LATENCY_SMOOTHING) * self.ms_per_pair + _LATENCY_SMOOTHING * per_pair
+            for i, value in zip(batch, values):
+                scores[i] = float(value)
+                self.cache.put(keys[i], float(value))
+            scored += len(batch)
+
+        ranked = sorted(scores, key=lambda i: -scores[i])
+        ranked += [i for i in range(len(candidates)) if i not in scores]
+        logging.info(
+            f"🎯 Re-ranked {len(scores)}/{len(candidates)} candidates ({scored} scored) "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+        return [candidates[i] for i in ranked[:top_k]]
+
+    def candidate_count(self, top_k):
+        # How many ANN hits to fetch so re-ranking has something to choose from
+        return max(top_k, RERANK_CANDIDATES) if self.enabled else top_k
@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import importlib
+import threading
+from functools import lru_cache
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+# "torch" (default), "onnx", or "onnx-int8" (dynamically quantized ONNX on CPU)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+# onnxruntime quantization target: arm64, avx2, avx512 or avx512_vnni
+EMBED_ONNX_INT8_CONFIG = os.getenv("EMBED_ONNX_INT8_CONFIG", "avx512_vnni")
+# Local int8 exports for models that don't publish one
+ONNX_CACHE_DIR = os.path.expanduser(os.getenv("ONNX_CACHE_DIR", "~/.cache/ragtoriches/onnx"))
+
+# ────────────────────────────────────────────────
+# LAZY RESOURCES
+# ────────────────────────────────────────────────
+class Lazy:
+    """Stands in for a heavy object until its first attribute access.
+
+    The factory runs once per proxy, under a lock, and the result is kept for
+    the life of the process; every attribute is forwarded to it. Module-level
+    `model = Lazy(...)` keeps `model.encode(...)` call sites unchanged while
+    imports, `--help` and env checks stay cheap.
+    """
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start = time.perf_counter()
+                    self._value = self._factory()
+                    logging.info(f"⏱️ Loaded {self._name} in {time.perf_counter() - start:.2f}s")
+        return self._value
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def __getattr__(self, attr):
+        # Only reached for attributes the proxy itself doesn't have
+        if attr in ("_name", "_factory", "_value", "_lock"):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
+
+    def __repr__(self):
+        return f"Lazy({self._name}, {'loaded' if self.loaded else 'not loaded'})"
+
+# ────────────────────────────────────────────────
+# PER-PROCESS FACTORIES
+# ────────────────────────────────────────────────
+@lru_cache(maxsize=None)
+def embedding_model(name, backend=None):
+    # One instance per (model, backend) per process, shared by every module that asks
+    from sentence_transformers import SentenceTransformer
+    backend = backend or EMBED_BACKEND
+    if backend == "torch":
+        return SentenceTransformer(name)
+    if backend == "onnx":
+        return SentenceTransformer(name, backend="onnx")
+    if backend == "onnx-int8":
+        return _int8_onnx_model(name)
+    raise ValueError(f"Unknown embedding backend: {backend} (expected torch, onnx or onnx-int8)")
+
+
+def _int8_onnx_model(name):
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    file_name = f"onnx/model_qint8_{EMBED_ONNX_INT8_CONFIG}.onnx"
+    # Check first: a missing file_name makes sentence-transformers export fp32 instead
+    if _has_file(name, file_name):
+        return SentenceTransformer(name, backend="onnx", model_kwargs={"file_name": file_name})
+
+    local_dir = os.path.join(ONNX_CACHE_DIR, name.replace("/", "__"))
+    if not os.path.exists(os.path.join(local_dir, file_name)):
+        logging.info(f"🔧 {name} has no {file_name}; exporting an int8 ONNX model to {local_dir}")
+        model = SentenceTransformer(name, backend="onnx")
+        model.save(local_dir)
+        export_dynamic_quantized_onnx_model(model, EMBED_ONNX_INT8_CONFIG, local_dir)
+    if not os.path.exists(os.path.join(local_dir, file_name)):
+        raise RuntimeError(f"int8 ONNX export of {name} did not produce {file_name}; "
+                           f"set EMBED_BACKEND=onnx to run it unquantized")
+    return SentenceTransformer(local_dir, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def _has_file(name, file_name):
+    # Local model directory, else the hub listing (unreachable hub counts as missing)
+    if os.path.isdir(name):
+        return os.path.exists(os.path.join(name, file_name))
+    try:
+        from huggingface_hub import list_repo_files
+        return file_name in list_repo_files(name)
+    except Exception as e:
+        logging.warning(f"⚠️ Could not list files of {name}: {e}")
+        return False
+
+
+@lru_cache(maxsize=None)
+def sql_engine(conn_string, **options):
+    from sqlalchemy import create_engine
+    return create_engine(conn_string, **options)
+
+
+@lru_cache(maxsize=None)
+def azure_openai_client(api_key, api_version, azure_endpoint):
+    from openai import AzureOpenAI
+    return AzureOpenAI(api_key=api_key, api_version=api_version, azure_endpoint=azure_endpoint)
+
+
+def lazy_embedder(name, backend=None):
+    return Lazy(name, lambda: embedding_model(name, backend))
+
+
+def lazy_engine(conn_string, **options):
+    return Lazy("database engine", lambda: sql_engine(conn_string, **options))
+
+
+def lazy_azure_client(api_key, api_version, azure_endpoint):
+    return Lazy("Azure OpenAI client", lambda: azure_openai_client(api_key, api_version, azure_endpoint))
+
+# ────────────────────────────────────────────────
+# STARTUP MEASUREMENT
+# ────────────────────────────────────────────────
+def measure_startup(module_name, function, query, repeats=2):
+    """Import time, then the latency of the first and following calls.
+
+    The first call pays for every lazy resource it touches, so the gap
+    between it and the next one is the deferred load cost.
+    """
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    report = {"import_s": time.perf_counter() - start, "calls_s": []}
+    logging.info(f"📦 import {module_name}: {report['import_s']:.2f}s")
+    for i in range(repeats):
+        start = time.perf_counter()
+        getattr(module, function)(query)
+        report["calls_s"].append(time.perf_counter() - start)
+        logging.info(f"🔎 {function} call {i + 1}: {report['calls_s'][-1]:.2f}s")
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    parser = argparse.ArgumentParser(description="Measure cold start and first-query latency of a script.")
+    parser.add_argument("module", help="e.g. query_improved, query_faiss")
+    parser.add_argument("--function", default="search_similar_chunks",
+                        help="called with the query (query_faiss: retrieve_chunks_faiss)")
+    parser.add_argument("--query", default="What are the failure modes of a hydraulic pump?")
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+    sys.path.insert(0, os.getcwd())
+    measure_startup(args.module, args.function, args.query, args.repeats)
@@ -0,0 +1,115 @@
+import os
+import json
+import logging
+import numpy as np
+from query_cache import TTLCache, normalize_query
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+ROUTER_MODEL = os.getenv("ROUTER_MODEL", "all-MiniLM-L6-v2")
+# Below this cosine similarity to the best centroid, or this gap to the
+# runner-up, the request is left to the LLM fallback
+ROUTER_MIN_SIMILARITY = float(os.getenv("ROUTER_MIN_SIMILARITY", "0.35"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.03"))
+ROUTER_CACHE_SIZE = int(os.getenv("ROUTER_CACHE_SIZE", "4096"))
+ROUTER_CACHE_TTL_SECONDS = float(os.getenv("ROUTER_CACHE_TTL_SECONDS", "86400"))
+# Optional JSON file with the same shape as DEFAULT_ROUTES
+ROUTER_ROUTES_PATH = os.getenv("ROUTER_ROUTES_PATH")
+
+# label → whether to pull web context, whether it needs the large model,
+# and example requests that define the route's centroid
+DEFAULT_ROUTES = {
+    "complex engineering analysis": {
+        "search": True,
+        "complex": True,
+        "examples": [
+            "Perform a full failure modes and effects analysis for a hydraulic braking system",
+            "Build a fault tree for loss of coolant in a pressurized water reactor",
+            "Model the fatigue life of a welded steel bridge girder under cyclic traffic loads",
+            "Run a multi-physics thermal and structural assessment of a battery pack enclosure",
+            "Produce a system safety hazard analysis for an autonomous delivery drone",
+            "Compare design alternatives for a high-pressure gas pipeline with a quantitative risk assessment",
+        ],
+    },
+    "engineering analysis": {
+        "search": True,
+        "complex": False,
+        "examples": [
+            "Assess the risk of corrosion failure in an offshore platform riser",
+            "Write a short design review report for a centrifugal pump",
+            "Estimate the reliability of a cooling fan from its failure data",
+            "Summarize the failure modes of lithium-ion cells",
+            "Simulate heat transfer through a double-pane window",
+            "Evaluate whether this beam design meets deflection limits",
+        ],
+    },
+    "technical question": {
+        "search": False,
+        "complex": False,
+        "examples": [
+            "What is the difference between stress and strain?",
+            "Define mean time between failures",
+            "Convert 30 psi to kilopascals",
+            "What does FMEA stand for?",
+            "Explain Ohm's law",
+            "What is the yield strength of 6061 aluminum?",
+        ],
+    },
+}
+
+# ────────────────────────────────────────────────
+# ROUTER
+# ────────────────────────────────────────────────
+class Router:
+    """Nearest-centroid request classifier over sentence embeddings.
+
+    Each route's centroid is the normalized mean embedding of its examples.
+    `classify()` returns (label, similarity), with label None when the best
+    match is under ROUTER_MIN_SIMILARITY or too close to the runner-up, so
+    the caller can fall back to an LLM. Results are cached per normalized
+    request text.
+    """
+
+    def __init__(self, model, routes=None):
+        self.model = model
+        self.routes = routes or load_routes()
+        self.labels = list(self.routes)
+        self.cache = TTLCache(ROUTER_CACHE_SIZE, ROUTER_CACHE_TTL_SECONDS)
+        self.centroids = np.stack([self._centroid(self.routes[label]["examples"]) for label in self.labels])
+
+    def _centroid(self, examples):
+        vectors = self.model.encode(examples, normalize_embeddings=True)
+        centroid = np.mean(vectors, axis=0)
+        return centroid / (np.linalg.norm(centroid) or 1.0)
+
+    def classify(self, text):
+        key = normalize_query(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        vector = self.model.encode(text, normalize_embeddings=True)
+        scores = self.centroids @ vector
+        order = np.argsort(-scores)
+        best = float(scores[order[0]])
+        margin = best - float(scores[order[1]]) if len(order) > 1 else best
+        label = self.labels[order[0]]
+        if best < ROUTER_MIN_SIMILARITY or margin < ROUTER_MIN_MARGIN:
+            logging.info(f"🧭 Low-confidence route ({label}: {best:.2f}, margin {margin:.2f})")
+            label = None
+        result = (label, best)
+        self.cache.put(key, result)
+        return result
+
+    def flags(self, label):
+        # (search, complex) for a route label
+        route = self.routes[label]
+        return route["search"], route["complex"]
+
+
+def load_routes(path=ROUTER_ROUTES_PATH):
+    if not path:
+        return DEFAULT_ROUTES
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
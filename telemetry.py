@@ -0,0 +1,98 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from bulk_writer import BulkWriter
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+# A batch is written when it reaches this many rows or this age, whichever first
+TELEMETRY_FLUSH_ROWS = int(os.getenv("TELEMETRY_FLUSH_ROWS", "200"))
+TELEMETRY_FLUSH_SECONDS = float(os.getenv("TELEMETRY_FLUSH_SECONDS", "1.0"))
+# Rows held in memory while the database is slow or down; newer rows are dropped past it
+TELEMETRY_MAX_QUEUE = int(os.getenv("TELEMETRY_MAX_QUEUE", "10000"))
+TELEMETRY_RETRIES = int(os.getenv("TELEMETRY_RETRIES", "3"))
+
+_STOP = object()
+
+# ────────────────────────────────────────────────
+# TELEMETRY WRITER
+# ────────────────────────────────────────────────
+class TelemetryWriter:
+    """Writes log rows from a background thread, off the request path.
+
+    `record(row)` only enqueues (no I/O). A daemon thread drains the queue
+    into COPY batches through BulkWriter, each committed in its own
+    transaction, and retries a failed batch before giving up on it. When the
+    queue is full, rows are dropped and counted rather than blocking the
+    caller. Remaining rows are flushed on close() / interpreter exit.
+    """
+
+    def __init__(self, engine, table, columns, flush_rows=TELEMETRY_FLUSH_ROWS,
+                 flush_seconds=TELEMETRY_FLUSH_SECONDS, max_queue=TELEMETRY_MAX_QUEUE):
+        self.writer = BulkWriter(engine, table, columns)
+        self.table = table
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=f"telemetry-{table}", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, row):
+        try:
+            self.queue.put_nowait(tuple(row))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logging.warning(f"⚠️ {self.table} telemetry queue full; {self.dropped} rows dropped")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = None
+            while len(batch) < self.flush_rows:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    row = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        for attempt in range(1, TELEMETRY_RETRIES + 1):
+            try:
+                self.writer.write(batch)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                logging.warning(f"⚠️ {self.table} telemetry write failed (attempt {attempt}): {e}")
+                time.sleep(min(2 ** attempt * 0.1, 2.0))
+        self.failed += len(batch)
+        logging.error(f"❌ Gave up on {len(batch)} {self.table} telemetry rows")
+
+    def close(self, timeout=10):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)  # blocks only if full, and the thread is draining it
+        self.thread.join(timeout)
+        logging.info(
+            f"📊 {self.table} telemetry: {self.written} written, "
+            f"{self.dropped} dropped, {self.failed} failed"
+        )
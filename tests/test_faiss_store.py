@@ -0,0 +1,65 @@
+import os
+import numpy as np
+from faiss_store import VectorSpool, read_spool, prune_spool
+
+DIM = 4
+
+
+def vectors_for(ids):
+    # Row i is filled with its id, so alignment is easy to check
+    return np.repeat(np.asarray(ids, dtype="float32")[:, None], DIM, axis=1)
+
+
+def write_spool(path, ids, append=False):
+    spool = VectorSpool(path, DIM, append=append)
+    spool.write(vectors_for(ids), ids)
+    spool.close()
+    spool.commit()
+
+
+def test_fresh_spool_is_swapped_in_on_commit(tmp_path):
+    path = str(tmp_path / "spool")
+    write_spool(path, [1, 2, 3])
+    old_vectors, old_ids = read_spool(path, DIM)
+
+    spool = VectorSpool(path, DIM)
+    spool.write(vectors_for([7, 8]), [7, 8])
+    spool.close()
+    # Written beside the live files until commit
+    assert list(read_spool(path, DIM)[1]) == [1, 2, 3]
+
+    spool.commit()
+    vectors, ids = read_spool(path, DIM)
+    assert list(ids) == [7, 8]
+    assert np.array_equal(vectors, vectors_for([7, 8]))
+    assert not os.path.exists(f"{path}.f32.tmp")
+    # A reader that mapped the old spool still sees it whole
+    assert list(old_ids) == [1, 2, 3]
+    assert np.array_equal(old_vectors, vectors_for([1, 2, 3]))
+
+
+def test_append_grows_the_live_spool(tmp_path):
+    path = str(tmp_path / "spool")
+    write_spool(path, [1, 2])
+    write_spool(path, [3], append=True)
+    vectors, ids = read_spool(path, DIM)
+    assert list(ids) == [1, 2, 3]
+    assert np.array_equal(vectors, vectors_for([1, 2, 3]))
+
+
+def test_prune_drops_ids_and_keeps_rows_aligned(tmp_path):
+    path = str(tmp_path / "spool")
+    write_spool(path, list(range(10)))
+    removed = prune_spool(path, DIM, [0, 4, 9, 42], block_rows=3)
+    assert removed == 3
+    vectors, ids = read_spool(path, DIM)
+    assert list(ids) == [1, 2, 3, 5, 6, 7, 8]
+    assert np.array_equal(vectors, vectors_for([1, 2, 3, 5, 6, 7, 8]))
+
+
+def test_prune_everything_leaves_an_empty_spool(tmp_path):
+    path = str(tmp_path / "spool")
+    write_spool(path, [1, 2])
+    assert prune_spool(path, DIM, [1, 2]) == 2
+    vectors, ids = read_spool(path, DIM)
+    assert vectors.shape == (0, DIM) and len(ids) == 0
@@ -0,0 +1,96 @@
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from embed_batch import EmbeddingBatcher
+from ingest_pipeline import run_pipeline
+
+PATHS = [f"file{i}.pdf" for i in range(12)]
+CHUNKS_PER_FILE = 3
+
+
+class FakeModel:
+    def encode(self, batch, batch_size, normalize_embeddings):
+        return [np.ones(4, dtype="float32") for _ in batch]
+
+
+# Parse functions run in the process pool, so they live at module level
+def parse(path):
+    return f"text of {path}"
+
+
+def parse_and_die(path):
+    os._exit(1)
+
+
+def chunk(path, raw_text):
+    return [(f"{raw_text} #{i}", {"path": path, "i": i}) for i in range(CHUNKS_PER_FILE)]
+
+
+def run(timeout=30, **options):
+    # Runs the pipeline on a thread so a hang fails the test instead of the session
+    options.setdefault("parse_fn", parse)
+    options.setdefault("write_fn", len)
+    result = {}
+
+    def go():
+        try:
+            result["stored"] = run_pipeline(
+                PATHS, options.pop("parse_fn"), chunk,
+                EmbeddingBatcher(FakeModel(), batch_size=2, workers=1),
+                options.pop("write_fn"), parse_workers=2, queue_size=1, **options,
+            )
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=go, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not stop"
+    return result
+
+
+def test_stores_every_chunk():
+    assert run() == {"stored": len(PATHS) * CHUNKS_PER_FILE}
+
+
+def test_failed_writes_report_their_payloads():
+    calls = {"n": 0}
+    reported = []
+
+    def flaky_write(embedded):
+        calls["n"] += 1
+        if calls["n"] % 2:
+            raise RuntimeError("db down")
+        return len(embedded)
+
+    result = run(write_fn=flaky_write, on_error=lambda payloads, error: reported.extend(payloads))
+    assert reported
+    assert result["stored"] + len(reported) == len(PATHS) * CHUNKS_PER_FILE
+
+
+def test_failing_error_handler_is_raised():
+    def broken_write(embedded):
+        raise RuntimeError("db down")
+
+    def broken_handler(payloads, error):
+        raise ValueError("handler broke")
+
+    result = run(write_fn=broken_write, on_error=broken_handler)
+    assert isinstance(result["error"], ValueError)
+
+
+def test_broken_parse_pool_is_raised():
+    result = run(parse_fn=parse_and_die)
+    assert isinstance(result["error"], BrokenProcessPool)
+
+
+def test_chunk_errors_skip_only_that_file():
+    def picky_chunk(path, raw_text):
+        if path == PATHS[0]:
+            raise ValueError("bad file")
+        return chunk(path, raw_text)
+
+    stored = run_pipeline(PATHS, parse, picky_chunk, EmbeddingBatcher(FakeModel(), workers=1),
+                          len, parse_workers=1)
+    assert stored == (len(PATHS) - 1) * CHUNKS_PER_FILE
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("asyncpg")
+pytest.importorskip("openai")
+from aiohttp.test_utils import TestClient, TestServer
+import query_service
+
+
+class FakeService:
+    def __init__(self):
+        self.questions = []
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def answer(self, question, hybrid=False):
+        self.questions.append(question)
+        return {"answer": "ok", "timings": {"total_ms": 1.0}}
+
+    async def answer_stream(self, question, hybrid=False):
+        self.questions.append(question)
+        yield {"token": "ok"}
+        yield {"done": True}
+
+
+def post(path, data):
+    # Returns (status, decoded body, questions the service received)
+    async def go():
+        service = FakeService()
+        async with TestClient(TestServer(query_service.make_app(service))) as client:
+            response = await client.post(path, data=data, headers={"Content-Type": "application/json"})
+            return response.status, await response.text(), service.questions
+    return asyncio.run(go())
+
+
+@pytest.mark.parametrize("path", ["/ask", "/ask/stream"])
+@pytest.mark.parametrize("data", ["not json", "[1, 2]", '"a question"', "null", "{}", '{"question": "  "}'])
+def test_bad_requests_get_400(path, data):
+    status, body, questions = post(path, data)
+    assert status == 400
+    assert "error" in json.loads(body)
+    assert questions == []
+
+
+def test_ask_answers_the_question():
+    status, body, questions = post("/ask", json.dumps({"question": " What is FMEA? "}))
+    assert status == 200
+    assert json.loads(body)["answer"] == "ok"
+    assert questions == ["What is FMEA?"]
+
+
+def test_ask_stream_sends_ndjson():
+    status, body, questions = post("/ask/stream", json.dumps({"question": "What is FMEA?"}))
+    assert status == 200
+    assert [json.loads(line) for line in body.splitlines()] == [{"token": "ok"}, {"done": True}]
+    assert questions == ["What is FMEA?"]
@@ -0,0 +1,67 @@
+import sys
+import time
+import types
+import pytest
+from rerank import Reranker
+
+LOAD_SECONDS = 0.3
+PAIR_SECONDS = 0.001
+
+
+class FakeCrossEncoder:
+    # Scores a pair by the number in its text; slow to load, quick per pair
+    instances = []
+
+    def __init__(self, name, device):
+        time.sleep(LOAD_SECONDS)
+        self.pairs = []
+        FakeCrossEncoder.instances.append(self)
+
+    def predict(self, pairs, batch_size):
+        time.sleep(PAIR_SECONDS * len(pairs))
+        self.pairs.extend(pairs)
+        return [float(text.split()[-1]) for _, text in pairs]
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    FakeCrossEncoder.instances = []
+    module = types.ModuleType("sentence_transformers")
+    module.CrossEncoder = FakeCrossEncoder
+    monkeypatch.setitem(sys.modules, "sentence_transformers", module)
+    return Reranker(model_name="fake", budget_ms=1000, batch_size=4, enabled=True)
+
+
+def rows(n):
+    # (id, text) in ANN order; higher ids score higher
+    return [(i, f"chunk {i}") for i in range(n)]
+
+
+def test_cold_load_is_not_counted_as_pair_latency(reranker):
+    reranker.rerank("question", rows(4), top_k=2)
+    assert reranker.ms_per_pair < LOAD_SECONDS * 1000 / 10
+
+
+def test_budget_caps_the_pairs_scored(reranker):
+    reranker.rerank("warm up", rows(2), top_k=1)
+    reranker.ms_per_pair = 10.0
+    reranker.budget_ms = 50
+    result = reranker.rerank("question", rows(20), top_k=20)
+    scored = [pair for pair in FakeCrossEncoder.instances[0].pairs if pair[0] == "question"]
+    assert len(scored) == 5
+    # The scored five come first by score, the rest keep ANN order
+    assert [row[0] for row in result] == [4, 3, 2, 1, 0] + list(range(5, 20))
+
+
+def test_scores_are_cached_per_query_and_chunk(reranker):
+    first = reranker.rerank("What  is FMEA?", rows(4), top_k=3)
+    model = FakeCrossEncoder.instances[0]
+    scored = len(model.pairs)
+    assert reranker.rerank("what is fmea?", rows(4), top_k=3) == first
+    assert len(model.pairs) == scored
+
+
+def test_disabled_keeps_ann_order(reranker):
+    reranker.enabled = False
+    assert reranker.rerank("question", rows(5), top_k=3) == rows(3)
+    assert not FakeCrossEncoder.instances
@@ -1,11 +1,12 @@
 import os
 import sys
-import psycopg2
-import numpy as np
-from sqlalchemy import create_engine, text
 from unstructured.partition.auto import partition  # unstructured.io OSS parser
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
+from bulk_writer import BulkWriter
+from query_cache import bump_index_version
+from embed_batch import EmbeddingBatcher, embed_texts
+from embedding_cache import open_cache
+from resources import lazy_embedder, lazy_engine
 
 # ================== CONFIGURATION ==================
 PG_CONN_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
@@ -13,8 +14,11 @@ if not PG_CONN_STRING:
     print("ERROR: Please set the POSTGRES_CONNECTION_STRING environment variable.")
     sys.exit(1)
 
-model = SentenceTransformer("intfloat/e5-large-v2")
-engine = create_engine(PG_CONN_STRING)
+MODEL_NAME = "intfloat/e5-large-v2"
+# Model and engine load on first use (see resources.py)
+model = lazy_embedder(MODEL_NAME)
+batcher = EmbeddingBatcher(model, workers=1, cache=open_cache(MODEL_NAME))
+engine = lazy_engine(PG_CONN_STRING)
 
 def parse_file(file_path):
     print(f"Parsing file with unstructured.io: {file_path}")
@@ -32,27 +36,22 @@ def embed_text(chunk):
     embedding = model.encode(chunk, normalize_embeddings=True)
     return embedding.tolist()
 
-def store_embedding(filename, chunk_id, chunk, embedding):
-    with engine.connect() as conn:
-        sql = text("""
-            INSERT INTO documents (filename, chunk_id, chunk_text, embedding)
-            VALUES (:filename, :chunk_id, :chunk_text, :embedding)
-        """)
-        conn.execute(sql, {
-            'filename': filename,
-            'chunk_id': chunk_id,
-            'chunk_text': chunk,
-            'embedding': embedding
-        })
-    print(f"Stored chunk {chunk_id} in DB")
+document_writer = BulkWriter(engine, "documents", ["filename", "chunk_id", "chunk_text", "embedding"])
+
+def store_embeddings(filename, chunks, embeddings):
+    document_writer.write(
+        (filename, i, chunk, embedding)
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+    )
+    bump_index_version()  # invalidates cached query results
+    print(f"Stored {len(chunks)} chunks in DB")
 
 def ingest_file(file_path):
     filename = os.path.basename(file_path)
     text = parse_file(file_path)
     chunks = chunk_text(text)
-    for i, chunk in enumerate(chunks):
-        embedding = embed_text(chunk)
-        store_embedding(filename, i, chunk, embedding)
+    embeddings = embed_texts(batcher, chunks)
+    store_embeddings(filename, chunks, embeddings)
 
 if __name__ == "__main__":
     while True:
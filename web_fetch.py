@@ -0,0 +1,239 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import lxml.html  # C parser; several times faster than html.parser
+except ImportError:
+    lxml = None
+
+# ────────────────────────────────────────────────
+# CONFIGURATION
+# ────────────────────────────────────────────────
+WEB_FETCH_WORKERS = int(os.getenv("WEB_FETCH_WORKERS", "8"))
+WEB_FETCH_PER_HOST = int(os.getenv("WEB_FETCH_PER_HOST", "2"))
+# Per-request timeout, and the budget for a whole fetch_texts() call
+WEB_FETCH_TIMEOUT = float(os.getenv("WEB_FETCH_TIMEOUT", "5"))
+WEB_FETCH_DEADLINE = float(os.getenv("WEB_FETCH_DEADLINE", "6"))
+WEB_CACHE_DIR = os.getenv(
+    "WEB_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "ragtoriches", "web"),
+)
+# Cached pages younger than this are used without revalidating
+WEB_CACHE_FRESH_SECONDS = float(os.getenv("WEB_CACHE_FRESH_SECONDS", "3600"))
+USER_AGENT = "RAGtoRiches/1.0 (+context fetcher)"
+
+# ────────────────────────────────────────────────
+# TEXT EXTRACTION
+# ────────────────────────────────────────────────
+def extract_text(html):
+    if lxml is not None:
+        try:
+            doc = lxml.html.document_fromstring(html)
+            for node in doc.xpath("//script|//style|//noscript|//template"):
+                node.drop_tree()
+            text = doc.text_content()
+        except (ValueError, lxml.etree.ParserError):
+            text = ""
+    else:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "html.parser")
+        for node in soup(["script", "style", "noscript", "template"]):
+            node.decompose()
+        text = soup.get_text(" ")
+    return re.sub(r"\s+", " ", text).strip()
+
+# ────────────────────────────────────────────────
+# DISK CACHE
+# ────────────────────────────────────────────────
+class PageCache:
+    """Extracted page text on disk plus the validators to revalidate it.
+
+    One JSON file per URL holding text, ETag, Last-Modified and fetch time;
+    the fetcher sends If-None-Match / If-Modified-Since and reuses the text
+    on 304 Not Modified.
+    """
+
+    def __init__(self, root=WEB_CACHE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.root, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, url, text, etag=None, last_modified=None):
+        entry = {"url": url, "text": text, "etag": etag, "last_modified": last_modified,
+                 "fetched_at": time.time()}
+        path = self._path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        return entry
+
+    def touch(self, url, entry):
+        entry["fetched_at"] = time.time()
+        return self.put(url, entry["text"], entry.get("etag"), entry.get("last_modified"))
+
+# ────────────────────────────────────────────────
+# FETCHER
+# ────────────────────────────────────────────────
+class WebFetcher:
+    """Fetches page text for many URLs at once.
+
+    One pooled requests.Session is shared by WEB_FETCH_WORKERS threads, at
+    most WEB_FETCH_PER_HOST requests hit the same host at a time, and
+    `fetch_texts` returns whatever finished within its deadline.
+    """
+
+    def __init__(self, workers=WEB_FETCH_WORKERS, per_host=WEB_FETCH_PER_HOST,
+                 timeout=WEB_FETCH_TIMEOUT, cache=None):
+        self.timeout = timeout
+        self.per_host = per_host
+        self.cache = cache if cache is not None else PageCache()
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=max(workers, per_host))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="web-fetch")
+        self.host_slots = {}
+        self.lock = threading.Lock()
+
+    def _slot(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def fetch_text(self, url, timeout=None):
+        # Returns the page's extracted text; raises on network/HTTP errors
+        cached = self.cache.get(url)
+        if cached is not None and time.time() - cached["fetched_at"] < WEB_CACHE_FRESH_SECONDS:
+            return cached["text"]
+
+        headers = {}
+        if cached is not None:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with self._slot(url):
+            response = self.session.get(url, headers=headers, timeout=timeout or self.timeout)
+        if response.status_code == 304 and cached is not None:
+            self.cache.touch(url, cached)
+            return cached["text"]
+        response.raise_for_status()
+
+        content_type = response.headers.get("Content-Type", "")
+        if "html" in content_type or not content_type:
+            text = extract_text(response.content)
+        else:
+            text = re.sub(r"\s+", " ", response.text).strip()
+        self.cache.put(url, text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return text
+
+    def fetch_texts(self, urls, max_chars=None, deadline=WEB_FETCH_DEADLINE):
+        """{url: text} for the URLs fetched within `deadline` seconds, in input order.
+
+        Failures and stragglers are logged and left out; stragglers keep running
+        in the background and land in the disk cache for next time.
+        """
+        start = time.perf_counter()
+        futures = {
+            url: self.executor.submit(self.fetch_text, url, min(self.timeout, deadline))
+            for url in dict.fromkeys(urls)
+        }
+        wait(futures.values(), timeout=deadline)
+
+        texts = {}
+        for url, future in futures.items():
+            if not future.done():
+                logging.warning(f"⏳ {url} missed the {deadline:.1f}s deadline")
+                continue
+            try:
+                text = future.result()
+            except Exception as e:
+                logging.warning(f"⚠️ Failed to load {url}: {e}")
+                continue
+            texts[url] = text[:max_chars] if max_chars else text
+        logging.info(f"🌐 Fetched {len(texts)}/{len(futures)} pages in {time.perf_counter() - start:.2f}s")
+        return texts
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+# ────────────────────────────────────────────────
+# LOCAL STAND-IN SERVER
+# ────────────────────────────────────────────────
+def make_stub_server(port=0, delay=0.5, etag='"stub-v1"'):
+    """Local HTTP stand-in for the real sites: every path returns the same
+    HTML page after `delay` seconds and honours If-None-Match. Returns the
+    server; call serve_forever() (e.g. in a thread) and shutdown()."""
+
+    page = (
+        "<html><head><style>p{color:red}</style><script>var x=1;</script></head>"
+        "<body><h1>Stub page</h1><p>Failure modes and effects analysis for pumps.</p></body></html>"
+    ).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    parser = argparse.ArgumentParser(description="Fetch page text concurrently, or run a local stand-in.")
+    parser.add_argument("urls", nargs="*")
+    parser.add_argument("--stub", action="store_true", help="fetch N copies of a page from a local stand-in")
+    parser.add_argument("--n", type=int, default=6)
+    parser.add_argument("--delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    server = None
+    urls = args.urls
+    if args.stub:
+        server = make_stub_server(delay=args.delay)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = [f"http://127.0.0.1:{server.server_address[1]}/page{i}" for i in range(args.n)]
+    fetcher = WebFetcher()
+    for url, text in fetcher.fetch_texts(urls, max_chars=200).items():
+        print(f"{url}: {text}")
+    fetcher.close()
+    if server is not None:
+        server.shutdown()